@@ -0,0 +1,116 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+Measure how much memory the add-on system uses for each add-on. This builds
+a temporary source with the given number of plugins, where two of every three
+plugins require the one before it, discovers them, and loads the header of
+each information file. The size of every object reachable from the add-ons
+is then added up, leaving out anything they share with the rest of the
+application, such as the list of sources. Run it with::
+
+    python benchmarks/addon_memory.py --count 1000
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+###############################################################################
+# Measurement
+###############################################################################
+
+# Objects that belong to the code rather than to any one add-on.
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType, types.MethodType)
+
+def write_plugins(folder, count):
+    """ Write the information files of ``count`` plugins to ``folder``. """
+    for i in xrange(count):
+        name = 'p%04d' % i
+        with open(os.path.join(folder, '%s.plugin' % name), 'w') as file:
+            file.write('[Core]\nversion = 1.0\n')
+            if i % 3:
+                file.write('[Requires]\nr0 = p%04d >= 0.5\n' % (i - 1))
+            file.write('[Description]\nname = %s\n' % name.title())
+
+def size_of(objects, seen):
+    """
+    Return the total size of the given objects and everything they refer
+    to, skipping anything whose id is in ``seen``. Every object counted is
+    added to ``seen``.
+    """
+    total = 0
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return total
+
+def measure(count):
+    """ Return the average number of bytes used by each of count add-ons. """
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, 'plugins'))
+        write_plugins(os.path.join(root, 'plugins'), count)
+
+        from siding import addons, path, profile
+        profile.initialize(profile_path=os.path.join(root, 'profile'),
+                           root_path=root)
+        import siding.plugins
+
+        found = addons.discover('plugin')
+        for addon in found:
+            addon.requires, addon.version, addon.module
+
+        seen = set()
+        size_of([path._sources], seen)
+        return size_of(found, seen) / float(len(found))
+
+    finally:
+        shutil.rmtree(root, True)
+
+###############################################################################
+# Command Line Interface
+###############################################################################
+
+def main(args=None):
+    """ Run the benchmark with the given command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog='python benchmarks/addon_memory.py',
+        description='Measure the memory used for each add-on.')
+    parser.add_argument('-n', '--count', type=int, default=1000,
+        help='How many plugins to create. Defaults to 1000.')
+
+    options = parser.parse_args(args)
+    print 'Bytes per add-on, for %d add-ons: %.0f' % (
+        options.count, measure(options.count))
+
+if __name__ == '__main__':
+    sys.exit(main())
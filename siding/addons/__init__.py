@@ -25,9 +25,11 @@ has an easy-to-customize in-app update system.
 # Imports
 ###############################################################################
 
-from siding.addons.base import action, AddonInfo
+from siding.addons import tracing
+from siding.addons.base import action, Action, AddonInfo
 from siding.addons.manager import DependencyError, manager
-from siding.addons.version import Version, VersionMatch
+from siding.addons.resolver import ResolutionError, Resolver
+from siding.addons.version import Version, VersionList, VersionMatch
 
 safe_mode = False
 
@@ -37,11 +39,25 @@ safe_mode = False
 
 add_type = manager.add_type
 discover = manager.discover
+discover_async = manager.discover_async
 find = manager.find
 get = manager.get
+load_order = manager.load_order
+remove = manager.remove
 
 check_inheritance = manager.check_inheritance
 check_dependencies = manager.check_dependencies
+invalidate = manager.invalidate
+flush_ui = manager.flush_ui
+
+blacklist = manager.blacklist
+unblacklist = manager.unblacklist
+is_blacklisted = manager.is_blacklisted
+blacklist_changed = manager.blacklist_changed
+discovery_progress = manager.discovery_progress
+discovery_finished = manager.discovery_finished
+
+timings = tracing.timings
 
 ###############################################################################
 # The UI Helper
@@ -59,13 +75,19 @@ def show():
 __all__ = [
     manager,  # The All Powerful
 
-    add_type, discover, get, find,  # Manager Functions
-    check_dependencies, check_inheritance,
+    add_type, discover, discover_async,  # Manager Functions
+    get, find, load_order, remove,
+    check_dependencies, check_inheritance, invalidate, flush_ui,
+    blacklist, unblacklist, is_blacklisted,
+    timings,
+
+    blacklist_changed, discovery_progress, discovery_finished,  # Signals
 
     action,  # Decorators
 
-    AddonInfo, DependencyError,  # Classes
-    Version, VersionMatch,
+    Action, AddonInfo, DependencyError,  # Classes
+    Resolver, ResolutionError,
+    Version, VersionList, VersionMatch,
 
     ##### UI Stuff ############################################################
 
@@ -26,13 +26,241 @@ add-on system.
 
 import errno
 import os
+import re
+import threading
 
 from collections import OrderedDict
+from ConfigParser import Error as ConfigParserError
+from ConfigParser import MissingSectionHeaderError, ParsingError
 from ConfigParser import SafeConfigParser
+from cStringIO import StringIO
 
 from siding import path, profile
+from siding.addons import tracing
 from siding.addons.version import Version, VersionMatch
 
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.addons')
+
+###############################################################################
+# Constants
+###############################################################################
+
+# These are the same as those used by ConfigParser.
+SECTION_MATCH = re.compile(r"\[(?P<header>[^]]+)\]")
+OPTION_MATCH = re.compile(r"(?P<option>[^:=\s][^:=]*)\s*[:=]\s*(?P<value>.*)$")
+
+# The sections needed to check an add-on's dependencies.
+HEADER_SECTIONS = ('Core', 'Requires')
+
+###############################################################################
+# Information File Parsing
+###############################################################################
+
+def parse_information(data, filename, only=None):
+    """
+    Parse the contents of an add-on information file and return an
+    :class:`~collections.OrderedDict` of sections, each of which is an
+    :class:`~collections.OrderedDict` of options.
+
+    This produces the same results, and raises the same exceptions, as
+    :class:`ConfigParser.SafeConfigParser`, in a single pass and without any
+    of the overhead. Files that use interpolation or have a ``DEFAULT``
+    section are handed off to SafeConfigParser.
+
+    If ``only`` is provided, it should be a collection of section names, and
+    the lines of every other section will be skipped without being parsed.
+    """
+    sections = OrderedDict()
+    section = None
+    option = None
+    error = None
+    skipping = False
+
+    lines = data.split('\n')
+    last = len(lines)
+
+    for lineno, line in enumerate(lines, 1):
+        # Comments and blank lines.
+        if not line.strip() or line[0] in '#;':
+            continue
+        if line[0] in 'rR' and line.split(None, 1)[0].lower() == 'rem':
+            continue
+
+        # Continuation lines.
+        if line[0].isspace() and section is not None and option:
+            if not skipping:
+                value = line.strip()
+                if value:
+                    section[option].append(value)
+            continue
+
+        match = SECTION_MATCH.match(line)
+        if match:
+            name = match.group('header')
+            if name == 'DEFAULT':
+                return _parse_information_slow(data, filename, only)
+
+            section = sections.get(name)
+            if section is None:
+                section = sections[name] = OrderedDict()
+            option = None
+            skipping = only is not None and not name in only
+            continue
+
+        if skipping:
+            option = True
+            continue
+
+        # ConfigParser's errors include the line ending.
+        if lineno < last:
+            line += '\n'
+
+        if section is None:
+            raise MissingSectionHeaderError(filename, lineno, line)
+
+        match = OPTION_MATCH.match(line)
+        if not match:
+            if not error:
+                error = ParsingError(filename)
+            error.append(lineno, repr(line))
+            continue
+
+        option, value = match.group('option', 'value')
+        option = option.rstrip().lower()
+
+        # ';' is a comment delimiter only if it follows a spacing character.
+        pos = value.find(';')
+        if pos != -1 and value[pos-1].isspace():
+            value = value[:pos]
+
+        value = value.strip()
+        if value == '""':
+            value = ''
+        section[option] = [value]
+
+    if error:
+        raise error
+
+    # Join multi-line values.
+    for section in sections.itervalues():
+        for key, value in section.iteritems():
+            value = '\n'.join(value)
+            if '%' in value:
+                return _parse_information_slow(data, filename, only)
+            section[key] = value
+
+    return sections
+
+def _parse_information_slow(data, filename, only=None):
+    """ Parse an add-on information file with SafeConfigParser. """
+    parser = SafeConfigParser()
+    parser.readfp(StringIO(data), filename)
+    return OrderedDict((name, OrderedDict(parser.items(name)))
+                       for name in parser.sections()
+                       if only is None or name in only)
+
+def convert_information(sections, name, header_only=False):
+    """
+    Convert the sections of an add-on information file, as returned by
+    :func:`parse_information`, into a tuple of ``(core, requires, data)`` as
+    described in :meth:`AddonInfo.read_information`. ``name`` is the name of
+    the add-on, for error messages.
+    """
+    # Read the core information.
+    if not 'Core' in sections:
+        raise ValueError(
+            "No Core section in the add-on information file for the "
+            "add-on %r." % name
+        )
+
+    core = dict(sections['Core'])
+    if 'version' in core:
+        core['version'] = Version(core['version'])
+
+    # Now, read the requirements.
+    requires = [VersionMatch.from_string(value) for value in
+                sections.get('Requires', {}).itervalues()]
+
+    # Finally, read the data section. This generally just contains a nice
+    # description of the add-on.
+    if header_only:
+        data = None
+    else:
+        data = sections.get('Data', {}).items()
+        data.extend(sections.get('Description', {}).iteritems())
+
+    return core, requires, data
+
+###############################################################################
+# Shared Structures
+###############################################################################
+
+class _EmptyDict(OrderedDict):
+    """
+    An empty, read-only :class:`~collections.OrderedDict`. A single instance
+    is shared by every add-on that has no requirements or file data.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("This dictionary is read-only.")
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+EMPTY_DICT = _EmptyDict()
+
+def _intern(value):
+    """ Intern the given value if it's a byte string. """
+    if type(value) is str:
+        return intern(value)
+    return value
+
+###############################################################################
+# Lazy Information
+###############################################################################
+
+_MISSING = object()
+
+# How much of an add-on's information file has been loaded.
+INFO_NONE = 0
+INFO_HEADER = 1
+INFO_FULL = 2
+
+# Held while any add-on's information is loaded or discarded, so that no
+# thread sees an add-on with its information half loaded. Loading is quick,
+# so one lock is shared rather than giving every add-on its own.
+_info_lock = threading.RLock()
+
+class _LazyInformation(object):
+    """
+    A descriptor for an :class:`AddonInfo` attribute that comes from the
+    add-on's information file. The file is only read the first time one of
+    these attributes is accessed. Once loaded, the value is stored in the
+    instance's dictionary, so this descriptor won't be consulted again.
+    """
+
+    def __init__(self, name, default=_MISSING, level=INFO_HEADER):
+        self.name = name
+        self.default = default
+        self.level = level
+
+    def __get__(self, obj, cls):
+        if obj is not None:
+            obj._ensure_information(self.level)
+            try:
+                return obj.__dict__[self.name]
+            except KeyError:
+                pass
+
+        if self.default is _MISSING:
+            raise AttributeError(self.name)
+        return self.default
+
 ###############################################################################
 # Action Decorator
 ###############################################################################
@@ -204,6 +432,39 @@ def action(text=None, icon=None, status_tip=None, tool_tip=None,
 
     return decorator
 
+class Action(object):
+    """
+    The record kept for each action of an :class:`AddonInfo` subclass, as
+    returned by :meth:`AddonInfo.actions`. The text, icon and tips aren't
+    copied, as they may be changed at any time. Read them from ``function``.
+    """
+    __slots__ = ('name', 'function', 'default', 'checkable', '_is_checked',
+                 '_is_enabled', '_is_visible')
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self.default = function.default
+        self.checkable = function._checkable
+        self._is_checked = function._is_checked
+        self._is_enabled = function._is_enabled
+        self._is_visible = function._is_visible
+
+    def __repr__(self):
+        return '<Action(%r)>' % self.name
+
+    def is_checked(self, addon):
+        """ Return True if the action is checked for the given add-on. """
+        return bool(self._is_checked and self._is_checked(addon))
+
+    def is_enabled(self, addon):
+        """ Return True if the action is enabled for the given add-on. """
+        return not self._is_enabled or bool(self._is_enabled(addon))
+
+    def is_visible(self, addon):
+        """ Return True if the action is visible for the given add-on. """
+        return not self._is_visible or bool(self._is_visible(addon))
+
 ###############################################################################
 # AddonInfo Class
 ###############################################################################
@@ -230,46 +491,74 @@ class AddonInfo(object):
     a callable that can be used to format the value.
     """
 
+    __slots__ = ('name', 'file', 'filedata', 'path', 'path_source',
+                 'needed_by', 'load_error', '_ui', '_info_level',
+                 '_info_loading', '_stamp', '__dict__')
+
     version = Version('1')
-    file = None
-    path = None
-    path_source = None
     _type_name = None
+    _manager = None
 
-    def __init__(self, name, filename, filedata=None, source=None):
+    # These are always set by load_information.
+    data = _LazyInformation('data', level=INFO_FULL)
+    requires = _LazyInformation('requires')
+
+    def __init__(self, name, filename, filedata=None, source=None,
+                 information=None):
         """
         Initialize the AddonInfo instance for an add-on with the provided name.
-        If a filename is provided, store it and attempt to load information
-        from that file.
+        If a filename is provided, store it. The information file won't be
+        read until information from it is first needed.
+
+        If ``information`` is provided, it should be a tuple, as returned by
+        :meth:`read_information`, and it will be used rather than reading the
+        information file. This is used when loading add-ons from a
+        precompiled manifest.
         """
+        # Make sure our lazy attributes are set up.
+        self._core_values()
+
+        # Initialize some structures. Empty structures are shared between
+        # every add-on, and replaced when there's something to store.
+        self._ui = ()
+        self._info_level = INFO_NONE
+        self._info_loading = INFO_NONE
+        self.load_error = None
 
-        # Initialize some structures.
-        self._ui = []
-        self.data = {'name': name}
-        self.filedata = filedata
         if filedata:
             if 'name' in filedata:
                 del filedata['name']
+        self.filedata = filedata or EMPTY_DICT
 
-        self.requires = OrderedDict()
-        self.needed_by = []
+        self.needed_by = ()
 
         # Now, store our information.
-        self.name = name
-
-        # Make sure our file exists.
-        if not path.exists(filename, source=source):
-            raise IOError(errno.ENOENT, 'No such file or directory: %r' %
-                                        filename)
-
-        # Store our path for later use.
-        self.path_source = path.source(filename, source=source)
-        self._path, self.file = os.path.split(filename)
-
-        # Make a PathContext, then go ahead and load.
-        self.path = path.PathContext(self._path, self.path_source)
-
-        self.load_information()
+        self.name = _intern(name)
+
+        if information is None:
+            # Find our file, and make sure it exists. Store the source for
+            # later use.
+            self.path_source = path.source(filename, source=source)
+            if self.path_source is None:
+                raise IOError(errno.ENOENT, 'No such file or directory: %r' %
+                                            filename)
+        else:
+            self.path_source = source
+
+        root, file = os.path.split(filename)
+        self.file = _intern(file)
+
+        # Make a PathContext.
+        self.path = path.PathContext(_intern(root), self.path_source)
+        self._stamp = None if information else self._file_stamp()
+
+        if information is not None:
+            self._info_loading = INFO_FULL
+            try:
+                self.apply_information(*information)
+                self._info_level = INFO_FULL
+            finally:
+                self._info_loading = INFO_NONE
 
     def __repr__(self):
         return '<%s(%r, version=%r)>' % (
@@ -282,14 +571,29 @@ class AddonInfo(object):
 
     @property
     def is_blacklisted(self):
-        """ Whether or not the add-on is blacklisted. """
+        """
+        Whether or not the add-on is blacklisted. Setting this blacklists or
+        unblacklists the add-on with :meth:`AddonManager.blacklist`.
+        """
+        if self._manager:
+            return self._manager.is_blacklisted(self._type_name, self.name)
         return bool(profile.get('siding/addons/blacklist/%s/%s' %
                                 (self._type_name, self.name)))
 
+    @is_blacklisted.setter
+    def is_blacklisted(self, value):
+        """ Blacklist or unblacklist the add-on. """
+        if not self._manager:
+            raise TypeError("%s isn't a registered add-on type." %
+                            self.__class__.__name__)
+        self._manager.blacklist(self._type_name, self.name, value)
+
     ##### User Interface Helpers ##############################################
 
     def _ui_add(self, widget):
         """ Keep a reference to the provided widget. """
+        if not self._ui:
+            self._ui = []
         self._ui.append(widget)
 
     def _ui_remove(self, widget):
@@ -301,45 +605,213 @@ class AddonInfo(object):
         """
         Update the user interface for this add-on. If an action is provided,
         only update that action. Otherwise, update all actions.
+
+        For registered add-on types, the update is deferred until control
+        returns to the event loop, so that calling this many times in a row
+        only updates each widget once.
         """
         if action:
             if not isinstance(action, basestring):
                 action = action.__name__
-            if (not hasattr(self, action) or
-                    not getattr(getattr(self, action), '_is_action', False)):
+            if not action in self.actions():
                 raise KeyError("%s instance has no action %r." % (
                                 self.__class__.__name__, action))
 
-        for ui in self._ui:
-            ui.update_actions(action)
+        if not self._ui:
+            return
+
+        if self._manager:
+            self._manager.update_ui(self, action)
+        else:
+            for ui in self._ui:
+                ui.update_actions(action)
 
     ##### Loading #############################################################
 
+    def _file_stamp(self):
+        """
+        Return the modification time and size of the information file, or
+        None if they can't be determined.
+        """
+        try:
+            stat = self.path.stat(self.file)
+        except (IOError, OSError):
+            return None
+        if stat is not None:
+            return stat.st_mtime, stat.st_size
+
+    @property
+    def is_modified(self):
+        """
+        Whether or not the information file has changed since the add-on was
+        discovered or its information was last reset.
+        """
+        if self._stamp is None:
+            return False
+        return self._file_stamp() != self._stamp
+
+    def reset_information(self):
+        """
+        Discard everything that was loaded from the information file. It will
+        be read again the next time information from it is needed.
+        """
+        with _info_lock:
+            # Lower the level first, so anything reading the information
+            # waits for it to be loaded again.
+            self._info_level = INFO_NONE
+            for key, option, key_type in self._core_values():
+                self.__dict__.pop(key, None)
+            self.__dict__.pop('requires', None)
+            self.__dict__.pop('data', None)
+
+        self.load_error = None
+        if self._stamp is not None:
+            self._stamp = self._file_stamp()
+
     def load_information(self):
         """ Load the add-on's information from file. """
-        parser = SafeConfigParser()
-        with self.path.open(self.file) as file:
-            parser.readfp(file, self.file)
-
-        # Read the core information.
-        if not parser.has_section('Core'):
-            raise ValueError(
-                "No Core section in the add-on information file for the "
-                "add-on %r." % self.name
-            )
+        with _info_lock:
+            self._info_loading = INFO_FULL
+            try:
+                self.apply_information(*self.read_information())
+                self._info_level = INFO_FULL
+            finally:
+                self._info_loading = INFO_NONE
+
+    def _ensure_information(self, level):
+        """
+        Make sure the information file has been loaded to at least the given
+        level. :data:`INFO_HEADER` only loads the Core and Requires sections,
+        which is enough for checking dependencies. If there's a problem, it's
+        logged and stored in :attr:`load_error`.
+        """
+        if self._info_level >= level:
+            return
+
+        with _info_lock:
+            # Another thread may have loaded it while we waited. If we're
+            # loading it ourselves, attribute access while we do mustn't start
+            # loading all over again.
+            if self._info_level >= level or self._info_loading >= level:
+                return
+
+            loading, self._info_loading = self._info_loading, level
+            try:
+                try:
+                    self.apply_information(*self.read_information(
+                                                        level == INFO_HEADER))
+                except (IOError, ValueError, ConfigParserError), err:
+                    log.exception('Problem loading add-on information for '
+                                  'the add-on %r (%r).' % (self.name,
+                                                           self.file))
+                    self.load_error = err
+                    self.__dict__.setdefault('requires', EMPTY_DICT)
+                    self.__dict__.setdefault('data', {'name': self.name})
+
+                # Only publish the level once everything has been stored.
+                self._info_level = max(self._info_level, level)
+            finally:
+                self._info_loading = loading
+
+    def read_information(self, header_only=False):
+        """
+        Read the add-on's information file and return a tuple of
+        ``(core, requires, data)`` without applying it to the add-on. ``core``
+        is a dictionary of the raw values in the Core section, with the
+        version already converted to a :class:`Version`, ``requires`` is a
+        list of ``(name, version_match)`` tuples, and ``data`` is a list of
+        ``(key, value)`` tuples from the Data and Description sections.
+
+        If ``header_only`` is True, only the Core and Requires sections are
+        read and ``data`` will be None.
+        """
+        with tracing.span('parse', self.name, self._type_name):
+            with self.path.open(self.file) as file:
+                sections = parse_information(file.read(), self.file,
+                                    HEADER_SECTIONS if header_only else None)
+
+        return convert_information(sections, self.name, header_only)
 
-        for key in self.CORE_VALUES + ('version',):
+    @classmethod
+    def _core_values(cls):
+        """
+        Return a tuple of ``(key, option, format)`` for every entry in
+        :attr:`CORE_VALUES`, plus the version. This is only worked out once
+        for each class.
+        """
+        values = cls.__dict__.get('_resolved_core_values')
+        if values is not None:
+            return values
+
+        values = []
+        for key in cls.CORE_VALUES + (('version', Version),):
             if isinstance(key, (list, tuple)):
                 key, key_type = key
                 if isinstance(key_type, basestring):
                     key_type = eval(key_type)
             else:
-                key_type = lambda thing: thing
+                key_type = None
+            values.append((key, key.lower(), key_type))
+
+            # Make the attribute load lazily, using any existing value as the
+            # default.
+            if not isinstance(cls.__dict__.get(key), _LazyInformation):
+                setattr(cls, key, _LazyInformation(key,
+                                                   getattr(cls, key, _MISSING)))
+
+        cls._resolved_core_values = values = tuple(values)
+        return values
+
+    @classmethod
+    def actions(cls):
+        """
+        Return an OrderedDict of every action defined on this class and its
+        bases, mapping names to :class:`Action` records. Base class actions
+        come first, and each class's actions are in the order they were
+        defined. This is only worked out once for each class, so user
+        interfaces don't have to inspect every add-on to build menus.
+        """
+        actions = cls.__dict__.get('_resolved_actions')
+        if actions is not None:
+            return actions
+
+        actions = OrderedDict()
+        for klass in reversed(cls.__mro__):
+            found = []
+            for key, value in klass.__dict__.iteritems():
+                if getattr(value, '_is_action', False):
+                    found.append((value.func_code.co_firstlineno, key, value))
+                elif key in actions:
+                    # A subclass has replaced the action with something else.
+                    del actions[key]
+
+            for line, key, value in sorted(found):
+                actions[key] = Action(key, value)
+
+        cls._resolved_actions = actions
+        return actions
+
+    @classmethod
+    def default_action(cls):
+        """
+        Return the :class:`Action` record of this class's default action, or
+        None if there isn't one.
+        """
+        for action in cls.actions().itervalues():
+            if action.default:
+                return action
 
+    def apply_information(self, core, requires, data):
+        """
+        Apply information, as returned by :meth:`read_information`, to the
+        add-on. If ``data`` is None, the add-on's data is left alone.
+        """
+        for key, option, key_type in self._core_values():
             # If we don't have that key, and we have a default value, just
             # continue, otherwise raise a ValueError.
-            if not parser.has_option('Core', key):
-                if not hasattr(self, key):
+            if not option in core:
+                if not key in self.__dict__ and \
+                        getattr(type(self), key, _MISSING) is _MISSING:
                     raise ValueError(
                         "Core value %r not defined in the add-on "
                         "information file for the add-on %r." %
@@ -348,23 +820,18 @@ class AddonInfo(object):
                 continue
 
             # Load the value and set it as an attribute of self.
-            setattr(self, key, key_type(parser.get('Core', key)))
+            value = core[option]
+            setattr(self, key, key_type(value) if key_type else value)
 
         # Split the inheritance.
         if (hasattr(self, 'inherits') and self.inherits and
                 isinstance(self.inherits, basestring)):
             self.inherits = [x.strip() for x in self.inherits.split(',')]
 
-        # Now, read the requirements.
-        if parser.has_section('Requires'):
-            for key, value in parser.items('Requires'):
-                name, match = VersionMatch.from_string(value)
-                self.requires[name] = match
-
-        # Finally, read the data section. This generally just contains a nice
-        # description of the add-on.
-        if parser.has_section('Data'):
-            self.data.update(parser.items('Data'))
+        # Store the requirements.
+        self.requires = OrderedDict(requires) if requires else EMPTY_DICT
 
-        if parser.has_section('Description'):
-            self.data.update(parser.items('Description'))
+        # And the data.
+        if data is not None:
+            self.data = {'name': self.name}
+            self.data.update(data)
@@ -0,0 +1,364 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+A reference update server for :class:`~siding.addons.updater.HTTPUpdater`,
+for testing updates locally and as an example of the protocol. It serves a
+directory laid out like this::
+
+    updates/
+        plugin/
+            foo.json
+            foo-1.2.0.zip
+
+Each information file lists the releases of one add-on, as described in
+:class:`~siding.addons.updater.HTTPUpdater`. Files are served as they are,
+and a ``POST`` to ``catalog`` answers for many add-ons at once. The request
+body looks like::
+
+    {"addons": [{"type": "plugin", "name": "foo", "version": "1.0.0"}]}
+
+and the response contains the information of every known add-on, with
+download URLs made relative to the catalog::
+
+    {"addons": {"plugin": {"foo": {"releases": [...]}}}}
+
+Every response has an ``ETag``, and files have a ``Last-Modified`` date too,
+so conditional requests are answered with ``304 Not Modified`` when nothing
+has changed. Files can also be requested in part, with a single ``Range``.
+
+Run it from the command line with::
+
+    python -m siding.addons.catalog path/to/updates --port 8000
+
+or start one in a test with::
+
+    server = CatalogServer('path/to/updates').start()
+    updater = HTTPUpdater(manager, server.url)
+
+To publish a release for delta updates, unpack it into a folder next to the
+information file, write its file manifest with::
+
+    python -m siding.addons.catalog path/to/updates --manifest plugin/foo-1.2.0
+
+and add ``"manifest": "foo-1.2.0/manifest.json"`` to the release.
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+import argparse
+import email.utils
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sys
+import threading
+import urllib
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.addons.catalog')
+
+###############################################################################
+# Constants
+###############################################################################
+
+CATALOG_PATH = 'catalog'
+MANIFEST_NAME = 'manifest.json'
+
+###############################################################################
+# File Manifests
+###############################################################################
+
+def build_manifest(directory):
+    """
+    Return the file manifest of an unpacked release in ``directory``, for
+    delta updates with :class:`~siding.addons.updater.HTTPUpdater`.
+    """
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in names:
+            filename = os.path.join(root, name)
+            relative = os.path.relpath(filename, directory).replace(os.sep,
+                                                                    '/')
+            if relative == MANIFEST_NAME:
+                continue
+
+            digest = hashlib.sha256()
+            with open(filename, 'rb') as file:
+                for chunk in iter(lambda: file.read(65536), ''):
+                    digest.update(chunk)
+            files[relative] = {'size': os.path.getsize(filename),
+                               'sha256': digest.hexdigest()}
+
+    return {'files': files}
+
+###############################################################################
+# Request Handler
+###############################################################################
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    """ Handles requests for a :class:`CatalogServer`. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def _local(self, name):
+        """
+        Return the local filename for the given URL path, or None if it's
+        outside of the root.
+        """
+        name = posixpath.normpath(urllib.unquote(name.split('?', 1)[0]))
+        parts = [part for part in name.split('/') if part]
+        if not parts or '..' in parts:
+            return None
+        return os.path.join(self.server.root, *parts)
+
+    def _send(self, status, body='', type='application/octet-stream',
+              headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _not_modified(self, etag, modified=None):
+        """
+        Return True if the request's validators match, and send a
+        ``304 Not Modified`` response.
+        """
+        match = self.headers.get('If-None-Match')
+        if match is not None:
+            fresh = etag in [x.strip() for x in match.split(',')]
+        elif modified is not None and self.headers.get('If-Modified-Since'):
+            since = email.utils.parsedate_tz(
+                self.headers.get('If-Modified-Since'))
+            fresh = since is not None and \
+                    int(modified) <= email.utils.mktime_tz(since)
+        else:
+            fresh = False
+
+        if fresh:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        return fresh
+
+    ##### Files ###############################################################
+
+    def do_GET(self):
+        filename = self._local(self.path)
+        if filename is None or not os.path.isfile(filename):
+            return self._send(404)
+
+        type = 'application/octet-stream'
+        if filename.endswith('.json'):
+            type = 'application/json'
+
+        with open(filename, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            etag = '"%x-%x"' % (stat.st_size, int(stat.st_mtime))
+            if self._not_modified(etag, stat.st_mtime):
+                return
+
+            # Only single ranges are supported, and only if the file hasn't
+            # changed since the client's copy.
+            start, end = 0, stat.st_size
+            match = re.match(r'bytes=(\d+)-(\d*)$',
+                             self.headers.get('Range', ''))
+            if match and self.headers.get('If-Range', etag) == etag:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)) + 1)
+                if start >= end:
+                    return self._send(416, headers=[
+                        ('Content-Range', 'bytes */%d' % stat.st_size)])
+
+            partial = end - start != stat.st_size
+            self.send_response(206 if partial else 200)
+            self.send_header('Content-Type', type)
+            self.send_header('Content-Length', str(end - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            if partial:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                                 start, end - 1, stat.st_size))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified',
+                             email.utils.formatdate(stat.st_mtime,
+                                                    usegmt=True))
+            self.end_headers()
+
+            if self.command != 'HEAD':
+                file.seek(start)
+                remaining = end - start
+                while remaining:
+                    chunk = file.read(min(remaining, 65536))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+    do_HEAD = do_GET
+
+    ##### The Catalog #########################################################
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        if self.path.split('?', 1)[0].strip('/') != CATALOG_PATH:
+            return self._send(404)
+
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self._send(400)
+
+        body = json.dumps(self.server.catalog(request), sort_keys=True)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if not self._not_modified(etag):
+            self._send(200, body, 'application/json', [('ETag', etag)])
+
+###############################################################################
+# The Server
+###############################################################################
+
+class CatalogServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server for the update directory ``root``. By default, it
+    listens on a free port of the local machine.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, address=('127.0.0.1', 0)):
+        HTTPServer.__init__(self, address, CatalogHandler)
+        self.root = os.path.abspath(root)
+        self._thread = None
+
+    @property
+    def url(self):
+        """ The base URL of the server. """
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        """ Serve requests on a background thread, and return self. """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the background thread and close the socket. """
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def catalog(self, request):
+        """
+        Build the response to a catalog request. Add-ons without an
+        information file are left out.
+        """
+        out = {}
+        for entry in request.get('addons', []):
+            type, name = entry.get('type'), entry.get('name')
+            if not type or not name or '/' in type + name or \
+                    type.startswith('.') or name.startswith('.'):
+                continue
+
+            relative = '%s/%s.json' % (type, name)
+            filename = os.path.join(self.root, type, '%s.json' % name)
+            try:
+                with open(filename, 'rb') as file:
+                    info = json.load(file)
+            except (IOError, ValueError):
+                continue
+
+            for release in info.get('releases', []):
+                for key in ('url', 'manifest'):
+                    if key in release:
+                        release[key] = urlparse.urljoin(relative,
+                                                        release[key])
+
+            out.setdefault(type, {})[name] = info
+
+        return {'addons': out}
+
+###############################################################################
+# Command Line Interface
+###############################################################################
+
+def main(args=None):
+    """ Run a catalog server with the given command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog='python -m siding.addons.catalog',
+        description='Serve add-on updates over HTTP.')
+    parser.add_argument('root', help='The directory of updates to serve.')
+    parser.add_argument('--host', default='127.0.0.1',
+        help='The address to listen on. Defaults to 127.0.0.1.')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+        help='The port to listen on. Defaults to 8000.')
+    parser.add_argument('--manifest', metavar='FOLDER', action='append',
+        help='Write the file manifest of an unpacked release in the given '
+             'folder, relative to the root, rather than serving. This may '
+             'be used more than once.')
+
+    options = parser.parse_args(args)
+
+    if options.manifest:
+        for folder in options.manifest:
+            folder = os.path.join(options.root, folder)
+            manifest = build_manifest(folder)
+            with open(os.path.join(folder, MANIFEST_NAME), 'wb') as file:
+                json.dump(manifest, file, indent=1, sort_keys=True)
+            print 'Wrote manifest of %d files for %s' % (
+                len(manifest['files']), folder)
+        return
+
+    server = CatalogServer(options.root, (options.host, options.port))
+    print 'Serving %s at %s' % (server.root, server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    sys.exit(main())
@@ -0,0 +1,114 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+A command line tool for building precompiled add-on manifests. When a source
+contains a manifest, :func:`siding.addons.discover` loads the add-ons listed in
+it with a single read rather than walking the source and parsing every
+information file. This is intended for frozen and packaged applications, where
+the bundled add-ons never change. Example::
+
+    python -m siding.addons.compile --import my_app.addon_types path/to/app
+
+The manifest is written to ``addons.manifest`` in the root of each source,
+unless ``--output`` is given. Manifests are never used for the profile path.
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+import argparse
+import marshal
+import os
+import sys
+
+from siding.addons.manager import manager, MANIFEST_FILE
+
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.addons.compile')
+
+###############################################################################
+# Manifest Writing
+###############################################################################
+
+def write_manifest(filename, source, type=None):
+    """
+    Build a manifest for the given source with
+    :meth:`~siding.addons.manager.AddonManager.build_manifest` and write it to
+    the given file. Returns the number of add-ons written.
+    """
+    manifest = manager.build_manifest(source, type)
+
+    with open(filename, 'wb') as file:
+        marshal.dump(manifest, file)
+
+    return sum(len(entries) for entries in manifest['types'].itervalues())
+
+###############################################################################
+# Command Line Interface
+###############################################################################
+
+def main(args=None):
+    """ Run the manifest compiler with the given command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog='python -m siding.addons.compile',
+        description='Build precompiled add-on manifests.')
+    parser.add_argument('sources', nargs='+', metavar='source',
+        help='A directory or package to search for add-ons.')
+    parser.add_argument('-t', '--type', action='append', dest='types',
+        help='Only include add-ons of this type. This may be used more than '
+             'once.')
+    parser.add_argument('-i', '--import', action='append', dest='modules',
+        default=[], help='Import this module before searching, so that it '
+                         'can register its add-on types.')
+    parser.add_argument('-o', '--output',
+        help='The file to write the manifest to.')
+
+    options = parser.parse_args(args)
+    if options.output and len(options.sources) > 1:
+        parser.error('--output can only be used with a single source.')
+
+    # Register the built-in add-on types, and then any others.
+    import siding.plugins
+    import siding.style
+
+    for module in options.modules:
+        __import__(module)
+
+    for source in options.sources:
+        if os.path.isdir(source):
+            source = os.path.abspath(source)
+            output = options.output or os.path.join(source, MANIFEST_FILE)
+        else:
+            if not source.startswith('py:'):
+                source = 'py:%s' % source
+            output = options.output
+            if not output:
+                parser.error('--output is required for the package %r.' %
+                             source[3:])
+
+        count = write_manifest(output, source, options.types)
+        print 'Wrote %d add-ons from %s to %s' % (count, source, output)
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    sys.exit(main())
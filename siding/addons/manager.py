@@ -25,12 +25,19 @@ get :class:`AddonInfo` instances.
 # Imports
 ###############################################################################
 
+import marshal
 import re
+import threading
 
-from PySide.QtCore import QCoreApplication
+from collections import OrderedDict
 
-from siding.addons.base import AddonInfo
-from siding import path
+from PySide.QtCore import QCoreApplication, QObject, QRunnable, QThreadPool
+from PySide.QtCore import Qt, QTimer, Signal, Slot
+
+from siding.addons import tracing
+from siding.addons.base import AddonInfo, INFO_HEADER
+from siding.addons.base import convert_information, parse_information
+from siding import path, profile
 
 ###############################################################################
 # Log
@@ -45,6 +52,9 @@ log = logging.getLogger('siding.addons')
 
 INFO_FILE_MATCH = re.compile(r"({.*?})")
 
+MANIFEST_FILE = 'addons.manifest'
+MANIFEST_FORMAT = 2
+
 class DependencyError(ValueError):
     """
     This exception is used by the :class:`AddonManager` when there's an issue
@@ -113,6 +123,358 @@ def parse_info_file(filename, type_name):
     output += r"$"
     return re.compile(output)
 
+###############################################################################
+# The Dependency Graph
+###############################################################################
+
+class DependencyGraph(object):
+    """
+    This class keeps track of the dependencies between all the add-ons known
+    to an :class:`AddonManager`. The graph is built once, the first time it's
+    needed, and detects dependency loops and calculates a load order in a
+    single pass. The result of checking each add-on's dependencies is cached
+    until that add-on, or one of its dependencies, is invalidated.
+    """
+
+    def __init__(self, manager):
+        self._manager = manager
+
+        # Structure. This is rebuilt whenever _edges is None.
+        self._edges = None
+        self._dependants = {}
+        self._loops = {}
+        self._order = []
+
+        # Cached results of dependency checks.
+        self._results = {}
+
+    ##### Structure ###########################################################
+
+    @property
+    def order(self):
+        """
+        A list of ``(type, name)`` keys for every known add-on, sorted so that
+        dependencies always come before the add-ons that require them.
+        """
+        self._ensure_built()
+        return self._order
+
+    def _ensure_built(self):
+        """ Rebuild the graph if it's been invalidated. """
+        if self._edges is None:
+            self._build()
+
+    def _build(self):
+        """
+        Build the edge tables from the requirements of every registered
+        add-on, and then use Tarjan's algorithm to find dependency loops and
+        the load order at the same time.
+        """
+        edges = {}
+        dependants = {}
+
+        for type, addons in self._manager._addons.iteritems():
+            for name, addon in addons.iteritems():
+                key = (type, name)
+                deps = edges[key] = []
+                for dname, match in addon.requires.iteritems():
+                    if dname == '__app__':
+                        deps.append((dname, match, None))
+                        continue
+
+                    d_type, _, d_name = dname.rpartition(':')
+                    dkey = (d_type or type, d_name)
+                    deps.append((dname, match, dkey))
+                    dependants.setdefault(dkey, set()).add(key)
+
+        # Tarjan's algorithm, done iteratively so deep dependency chains don't
+        # hit the recursion limit. Components are emitted with dependencies
+        # first, which is exactly the order we want to load things in.
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        order = []
+        loops = {}
+
+        for root in edges:
+            if root in index:
+                continue
+
+            work = [(root, 0)]
+            while work:
+                node, i = work.pop()
+                if i == 0:
+                    index[node] = low[node] = len(index)
+                    stack.append(node)
+                    on_stack.add(node)
+
+                deps = edges[node]
+                while i < len(deps):
+                    dkey = deps[i][2]
+                    i += 1
+                    if dkey is None or not dkey in edges:
+                        continue
+                    if not dkey in index:
+                        work.append((node, i))
+                        work.append((dkey, 0))
+                        break
+                    elif dkey in on_stack:
+                        low[node] = min(low[node], index[dkey])
+                else:
+                    # Every dependency has been visited.
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+
+                        if len(component) > 1 or any(
+                                d[2] == node for d in deps):
+                            chain = tuple(m[1] for m in reversed(component))
+                            for member in component:
+                                loops[member] = chain
+
+                        order.extend(reversed(component))
+
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+
+        self._edges = edges
+        self._dependants = dependants
+        self._loops = loops
+        self._order = order
+
+    ##### Invalidation ########################################################
+
+    def invalidate(self, addon=None, structure=True):
+        """
+        Discard the cached results for the given add-on and everything that
+        depends upon it. If ``structure`` is True, the graph itself will be
+        rebuilt the next time it's needed.
+        """
+        if addon is None:
+            self._results.clear()
+            self._edges = None
+            return
+
+        if structure:
+            self._edges = None
+
+        pending = [(addon._type_name, addon.name)]
+        seen = set()
+        while pending:
+            key = pending.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            self._results.pop(key, None)
+            pending.extend(self._dependants.get(key, ()))
+
+    ##### Checking ############################################################
+
+    def check(self, addon):
+        """
+        Check the dependencies of the given add-on, raising a
+        :class:`DependencyError` if they aren't satisfied.
+        """
+        self._ensure_built()
+
+        key = (addon._type_name, addon.name)
+        registered = self._manager._addons.get(key[0], {}).get(key[1])
+        if registered is not addon:
+            # Not something we know about, so don't cache it.
+            error = self._check(addon, key)
+        else:
+            try:
+                error = self._results[key]
+            except KeyError:
+                error = self._results[key] = self._check(addon, key)
+
+        if error:
+            raise error
+
+    def _check(self, addon, key):
+        """
+        Check the dependencies of the given add-on and return a
+        :class:`DependencyError` if there's a problem, or None.
+        """
+        if key in self._loops:
+            return DependencyError('Dependency loop: %r' % (self._loops[key],))
+
+        requires = addon.requires
+        if addon.load_error:
+            return DependencyError('Unable to load information for %r: %s' %
+                                   (addon.name, addon.load_error))
+
+        types = self._manager._types
+        addons = self._manager._addons
+
+        for dname, match in requires.iteritems():
+            if dname == '__app__':
+                version = app_version()
+            else:
+                d_type, _, name = dname.rpartition(':')
+                if not d_type:
+                    d_type = key[0]
+                if not d_type in types:
+                    return DependencyError(
+                        'Invalid add-on type %r in dependency %r of add-on %r.'
+                            % (d_type, dname, addon.data['name']))
+
+                # Get the dependency.
+                dinfo = addons.get(d_type, {}).get(name)
+                if dinfo is None:
+                    version = None
+                else:
+                    if dinfo.is_blacklisted:
+                        return DependencyError(
+                                'Dependency %r is blacklisted.' % dname)
+
+                    # Walk the dependency tree.
+                    try:
+                        self.check(dinfo)
+                    except DependencyError, err:
+                        return err
+                    version = dinfo.version
+
+            # Check the version.
+            if not match.test(version):
+                return DependencyError(
+                    'Unsatisfied dependency: %s %s' % (dname, match))
+
+###############################################################################
+# Signal Helper
+###############################################################################
+
+class Helper(QObject):
+    """
+    This class's sole purpose in life is providing a QObject to host the
+    signals of the :class:`AddonManager`.
+    """
+
+    blacklist_changed = Signal(str, str, bool)
+    discovery_progress = Signal(int, int)
+    discovery_finished = Signal(list)
+
+###############################################################################
+# Background Discovery
+###############################################################################
+
+class DiscoveryRelay(QObject):
+    """
+    This object lives on the GUI thread and receives the results of a
+    :class:`DiscoveryTask` through queued connections, so that add-ons are
+    always registered on the GUI thread.
+    """
+
+    progress = Signal(int, int)
+    scanned = Signal(object)
+
+    def __init__(self, manager):
+        QObject.__init__(self)
+        self.manager = manager
+
+        self.progress.connect(self._on_progress, Qt.QueuedConnection)
+        self.scanned.connect(self._on_scanned, Qt.QueuedConnection)
+
+    @Slot(int, int)
+    def _on_progress(self, done, total):
+        self.manager.discovery_progress.emit(done, total)
+
+    @Slot(object)
+    def _on_scanned(self, changes):
+        manager = self.manager
+        manager._tasks.discard(self)
+
+        output = []
+        if changes is not None:
+            output = manager._apply_discovery(changes)
+        manager.discovery_finished.emit(output)
+
+class DiscoveryTask(QRunnable):
+    """
+    A :class:`PySide.QtCore.QRunnable` that searches for add-ons on a worker
+    thread. See :meth:`AddonManager.discover_async`.
+    """
+
+    def __init__(self, manager, type, source, incremental):
+        QRunnable.__init__(self)
+        self.manager = manager
+        self.args = type, source, incremental
+        self.relay = DiscoveryRelay(manager)
+
+    def run(self):
+        changes = None
+        try:
+            changes = self.manager._scan(*self.args, preload=True,
+                                         progress=self.relay.progress.emit)
+        except Exception:
+            log.exception('Error discovering add-ons.')
+        self.relay.scanned.emit(changes)
+
+###############################################################################
+# User Interface Updates
+###############################################################################
+
+class UIBatch(QObject):
+    """
+    This object collects requests to update the user interface of add-ons, and
+    applies them all at once on the next pass through the event loop. No
+    matter how many times an add-on's actions are marked, each widget is
+    updated at most once per batch.
+    """
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._dirty = {}
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.flush)
+
+    def mark(self, addon, action=None):
+        """
+        Mark the given action of the add-on as needing an update. If action is
+        None, every action of the add-on will be updated.
+        """
+        actions = self._dirty.get(addon)
+        if actions is None:
+            actions = self._dirty[addon] = set()
+        actions.add(action)
+
+        # Without an event loop, there's nothing to wait for.
+        if QCoreApplication.instance() is None:
+            self.flush()
+        elif not self._timer.isActive():
+            self._timer.start()
+
+    @Slot()
+    def flush(self):
+        """ Update every widget with pending changes right now. """
+        self._timer.stop()
+        dirty, self._dirty = self._dirty, {}
+
+        widgets = {}
+        order = []
+        for addon, actions in dirty.iteritems():
+            action = actions.pop() if len(actions) == 1 else None
+            for ui in addon._ui:
+                if ui in widgets:
+                    if widgets[ui] != action:
+                        widgets[ui] = None
+                else:
+                    widgets[ui] = action
+                    order.append(ui)
+
+        for ui in order:
+            ui.update_actions(widgets[ui])
+
 ###############################################################################
 # The Add-on Manager
 ###############################################################################
@@ -128,9 +490,29 @@ class AddonManager(object):
     def __init__(self):
         super(AddonManager, self).__init__()
 
-        # Set up the storage tables.
+        # Set up the storage tables. The tables of add-ons are never changed
+        # in place, but replaced, so they can be safely read from any thread.
+        self._lock = threading.RLock()
         self._addons = {}
         self._types = {}
+        self._manifests = {}
+        self._blacklist = {}
+        self._tasks = set()
+
+        # Profile paths that staged updates have been applied to.
+        self._updated = set()
+
+        # And the dependency graph.
+        self.graph = DependencyGraph(self)
+
+        # Signals.
+        self._helper = Helper()
+        self.blacklist_changed = self._helper.blacklist_changed
+        self.discovery_progress = self._helper.discovery_progress
+        self.discovery_finished = self._helper.discovery_finished
+
+        # Pending user interface updates.
+        self._ui_batch = UIBatch()
 
     ##### Query Functions #####################################################
 
@@ -156,7 +538,7 @@ class AddonManager(object):
             types = [type] if type else self._types.keys()
 
         for type in types:
-            for addon in self._addons[type].itervalues():
+            for addon in self._addons.get(type, {}).itervalues():
                 if filter and not filter(addon):
                     continue
                 yield addon
@@ -212,115 +594,482 @@ class AddonManager(object):
             raise TypeError("info_class must be an AddonInfo subclass.")
 
         # Store it.
-        self._types[name] = info_class, info_regex, search_paths, text, icon
+        with self._lock:
+            self._types[name] = (info_class, info_regex, search_paths, text,
+                                 icon)
         info_class._type_name = name
+        info_class._manager = self
+
+        # Collect the class's actions now, rather than when building menus.
+        info_class.actions()
+
+    ##### Blacklisting ########################################################
+
+    def is_blacklisted(self, type, name):
+        """
+        Return True if the add-on of the given type and name is blacklisted.
+        The blacklist for each type is read from the profile once, and then
+        kept in memory.
+        """
+        try:
+            names = self._blacklist[type]
+        except KeyError:
+            names = self._blacklist[type] = set(key for key, value in
+                profile.group('siding/addons/blacklist/%s' % type).iteritems()
+                if value)
+        return name in names
+
+    def blacklist(self, type, name, blacklisted=True):
+        """
+        Blacklist, or if ``blacklisted`` is False, unblacklist the add-on of
+        the given type and name. The change is written to the profile, and the
+        ``blacklist_changed`` signal is emitted with the arguments
+        ``(type, name, blacklisted)`` if the state changed.
+        """
+        blacklisted = bool(blacklisted)
+        if self.is_blacklisted(type, name) == blacklisted:
+            return
+
+        key = 'siding/addons/blacklist/%s/%s' % (type, name)
+        if blacklisted:
+            profile.set(key, True)
+            self._blacklist[type].add(name)
+        else:
+            profile.remove(key)
+            self._blacklist[type].discard(name)
+
+        # Anything depending on the add-on needs to be checked again.
+        addon = self._addons.get(type, {}).get(name)
+        if addon is not None:
+            self.graph.invalidate(addon, False)
+
+        self.blacklist_changed.emit(type, name, blacklisted)
+
+    def unblacklist(self, type, name):
+        """ Remove the add-on of the given type and name from the blacklist. """
+        self.blacklist(type, name, False)
+
+    def reload_blacklist(self):
+        """
+        Discard the in-memory blacklist so it will be read from the profile
+        again. This should be used if a different profile is loaded.
+        """
+        self._blacklist.clear()
+        self.graph.invalidate()
+
+    ##### User Interface ######################################################
+
+    def update_ui(self, addon, action=None):
+        """
+        Schedule an update of the user interface for the given add-on. If an
+        action name is provided, only that action is updated. Updates are
+        collected, and applied once control returns to the event loop.
+        """
+        self._ui_batch.mark(addon, action)
+
+    def flush_ui(self):
+        """ Apply any pending user interface updates immediately. """
+        self._ui_batch.flush()
 
     ##### Add-on Discovery ####################################################
 
-    def discover(self, type=None, source=None):
+    def discover(self, type=None, source=None, incremental=False):
         """
         Discover any available add-ons in the known search paths. If ``type``
         is specified, only discover add-ons of that type or types. Returns a
         list of discovered add-ons.
 
+        Only the existence of each add-on's information file is checked here.
+        The file itself is read the first time information from it is needed.
+
+        Sources are searched in order. If a source, other than the profile
+        path, contains a precompiled manifest, as built by
+        :mod:`siding.addons.compile`, the add-ons listed in the manifest are
+        used rather than walking the source.
+
+        If ``incremental`` is True, the add-ons that are already known are
+        compared against what's found. Add-ons that are no longer found are
+        removed with :meth:`remove`, add-ons that are now found in a different
+        location are replaced, and add-ons with a modified information file
+        have their information reset so that it will be read again. Only new
+        and replaced add-ons are returned.
+
         This is probably the most important single function of the Add-on
         Manager, as it must be called before you can access your add-ons.
+
+        .. seealso:: :meth:`discover_async`
+        """
+        self._apply_updates()
+        return self._apply_discovery(self._scan(type, source, incremental))
+
+    def discover_async(self, type=None, source=None, incremental=False):
+        """
+        Discover add-ons, exactly like :meth:`discover`, but search for them
+        on a worker thread of the global :class:`PySide.QtCore.QThreadPool`.
+        The information files of new add-ons are also read on the worker
+        thread, so that their dependencies can be checked without blocking.
+
+        This returns immediately. Progress is reported with the
+        ``discovery_progress`` signal, and once the search is complete, the
+        add-ons are registered on the GUI thread and the
+        ``discovery_finished`` signal is emitted with the list of new add-ons.
+
+        This must be called from the GUI thread.
+        """
+        self._apply_updates()
+
+        task = DiscoveryTask(self, type, source, incremental)
+        self._tasks.add(task.relay)
+        QThreadPool.globalInstance().start(task)
+
+    def _apply_updates(self):
+        """
+        Move any updates staged in the profile by
+        :class:`~siding.addons.updater.HTTPUpdater` into place, once per
+        profile, before anything is found there. This is called on the
+        calling thread of :meth:`discover` and :meth:`discover_async`, so
+        add-on folders are never moved by a worker thread.
+        """
+        root = profile.profile_path
+        if not root or root in self._updated:
+            return
+        self._updated.add(root)
+
+        from siding.addons.updater import apply_updates
+        apply_updates(root)
+
+    def _scan(self, type=None, source=None, incremental=False, preload=False,
+              progress=None):
+        """
+        Search for add-ons and return a list of changes to be made by
+        :meth:`_apply_discovery`. The registries aren't modified at all, so
+        this is safe to run on a worker thread.
+
+        If ``preload`` is True, the headers of new add-ons are read
+        immediately. If ``progress`` is provided, it's called with
+        ``(done, total)`` after each source is searched for each type.
         """
         if isinstance(type, (tuple, list)):
             types = type
         else:
             types = [type] if type else self._types.keys()
 
-        output = []
+        if isinstance(source, (tuple, list)):
+            sources = list(source)
+        else:
+            sources = [source] if source else path._sources[:]
+
+        changes = []
+        done = 0
+        total = len(types) * len(sources)
 
         # Iterate over the type list, and walk for each type.
         for type in types:
             log.info('Discovering add-ons of type %r.' % type)
-            if not type in self._addons:
-                self._addons[type] = {}
-
-            info_class, info_regex, search_paths = self._types[type][:3]
-            for spath in search_paths:
-                log.debug('Searching path: %s' % spath)
-                for root, dirs, files in path.walk(spath, source=source):
-                    for file in files:
-                        filepath = path.join(root, file)
-                        match = info_regex.search(filepath)
-                        if not match:
-                            continue
-
-                        # If we've already got an add-on with this name, just
-                        # continue.
-                        name = match.group('name')
-                        if name in self._addons[type]:
-                            continue
-
-                        # We've got an add-on. Build the info instance.
-                        try:
-                            addon = info_class(name, filepath,
-                                            match.groupdict(), source=source)
-                        except (IOError, ValueError):
-                            log.exception(
-                                'Problem loading add-on information for the '
-                                'add-on %r (%r).' % (name, filepath))
-                            continue
-
-                        # Store it!
-                        log.info('Found %s: %s' % (type, addon.data['name']))
-                        self._addons[type][name] = addon
-                        output.append(addon)
+
+            addons = self._addons.get(type, {})
+            info_class = self._types[type][0]
+            found = set()
+
+            for src in sources:
+                with tracing.span('discover', src, type):
+                    self._scan_source(type, src, info_class, addons, found,
+                                      changes, incremental, preload)
+
+                done += 1
+                if progress:
+                    progress(done, total)
+
+            # Remove anything that's gone missing from the sources we searched.
+            if incremental:
+                for name, addon in addons.items():
+                    if not name in found and addon.path_source in sources:
+                        changes.append(('remove', addon))
 
         log.info('Discovery finished.')
+        return changes
+
+    def _scan_source(self, type, src, info_class, addons, found, changes,
+                     incremental, preload):
+        """ Search a single source for add-ons. See :meth:`_scan`. """
+        entries = self._manifest_entries(src, type)
+        if entries is None:
+            entries = ((name, filepath, filedata, None) for
+                       name, filepath, filedata in self._walk(type, src))
+
+        for name, filepath, filedata, information in entries:
+            # The first source to have an add-on wins.
+            if name in found:
+                continue
+            found.add(name)
+
+            # If we've already got an add-on with this name, just
+            # continue, unless we're looking for changes.
+            existing = addons.get(name)
+            if existing is not None:
+                if not incremental:
+                    continue
+
+                if existing.path_source == src and filepath == \
+                        path.join(existing.path.path, existing.file):
+                    if existing.is_modified:
+                        changes.append(('reload', existing))
+                    continue
+
+            # We've got an add-on. Build the info instance.
+            try:
+                addon = info_class(name, filepath, dict(filedata),
+                                   source=src, information=information)
+            except (IOError, ValueError):
+                log.exception(
+                    'Problem loading add-on information for the '
+                    'add-on %r (%r).' % (name, filepath))
+                continue
+
+            if preload:
+                addon._ensure_information(INFO_HEADER)
+
+            if existing is not None:
+                # It's moved, so replace it.
+                changes.append(('replace', existing, addon))
+            else:
+                changes.append(('add', addon))
+
+    def _apply_discovery(self, changes):
+        """
+        Apply the list of changes built by :meth:`_scan` to the registries,
+        and return a list of the new add-ons. This must be done on the GUI
+        thread.
+        """
+        output = []
+
+        with self._lock:
+            # Copy the tables we're changing, so anything iterating over the
+            # old ones on another thread isn't disturbed.
+            tables = {}
+            for change in changes:
+                addon = change[-1]
+                type = addon._type_name
+                if not type in tables:
+                    tables[type] = dict(self._addons.get(type, {}))
+                addons = tables[type]
+
+                if change[0] == 'reload':
+                    log.info('Reloading %s: %s' % (type, addon.name))
+                    addon.reset_information()
+                    self.graph.invalidate(addon)
+                    continue
+
+                elif change[0] == 'remove':
+                    self._remove(addon, addons)
+                    continue
+
+                elif change[0] == 'replace':
+                    self._remove(change[1], addons)
+
+                elif addon.name in addons:
+                    # Discovered more than once at the same time.
+                    continue
+
+                # Store it!
+                log.info('Found %s: %s' % (type, addon.name))
+                addons[addon.name] = addon
+                self.graph.invalidate(addon)
+                output.append(addon)
+
+            self._addons.update(tables)
+
         return output
 
+    def remove(self, addon):
+        """
+        Remove the given add-on from the Add-on Manager. If the add-on has an
+        ``on_remove`` function, it will be called first so that the add-on
+        can clean up after itself. Plugins, for example, are deactivated.
+        """
+        type = addon._type_name
+        with self._lock:
+            addons = dict(self._addons.get(type, {}))
+            self._remove(addon, addons)
+            self._addons[type] = addons
+
+    def _remove(self, addon, addons):
+        """ Remove the add-on from the given table. """
+        if hasattr(addon, 'on_remove'):
+            try:
+                addon.on_remove()
+            except Exception:
+                log.exception('Error removing add-on %r.' % addon.name)
+
+        if addons.get(addon.name) is addon:
+            del addons[addon.name]
+
+        self.graph.invalidate(addon)
+        log.info('Removed %s: %s' % (addon._type_name, addon.name))
+
+    def _walk(self, type, source):
+        """
+        Walk the search paths of the given type in the given source, and
+        generate a tuple of ``(name, filepath, filedata)`` for every file that
+        matches the type's information file pattern.
+        """
+        info_regex, search_paths = self._types[type][1:3]
+        for spath in search_paths:
+            log.debug('Searching path: %s' % spath)
+            for root, dirs, files in path.walk(spath, source=source):
+                for file in files:
+                    filepath = path.join(root, file)
+                    match = info_regex.search(filepath)
+                    if match:
+                        yield match.group('name'), filepath, match.groupdict()
+
+    ##### Manifests ###########################################################
+
+    def build_manifest(self, source, type=None):
+        """
+        Walk the given source and parse the information file of every add-on
+        found, returning a manifest that may be written to a file named
+        ``addons.manifest`` in the root of the source. When that file is
+        present, :meth:`discover` will load the add-ons from it rather than
+        walking the source.
+        """
+        if isinstance(type, (tuple, list)):
+            types = type
+        else:
+            types = [type] if type else self._types.keys()
+
+        manifest = {'format': MANIFEST_FORMAT, 'types': {}}
+        for type in types:
+            info_class = self._types[type][0]
+            entries = manifest['types'][type] = []
+            names = set()
+
+            for name, filepath, filedata in self._walk(type, source):
+                if name in names:
+                    continue
+
+                # Store the file as parsed, so the manifest is plain data,
+                # but make sure it's usable first.
+                try:
+                    addon = info_class(name, filepath, dict(filedata),
+                                       source=source)
+                    with addon.path.open(addon.file) as file:
+                        sections = parse_information(file.read(), addon.file)
+                    addon.apply_information(*convert_information(sections,
+                                                                 name))
+                except (IOError, ValueError):
+                    log.exception(
+                        'Problem loading add-on information for the '
+                        'add-on %r (%r).' % (name, filepath))
+                    continue
+
+                names.add(name)
+                entries.append((name, filepath, dict(filedata), tuple(
+                    (section, tuple(options.iteritems()))
+                    for section, options in sections.iteritems())))
+
+        return manifest
+
+    def _manifest_entries(self, source, type):
+        """
+        Return the list of manifest entries for the given source and type, or
+        None if the source doesn't have a usable manifest.
+        """
+        if source == profile.profile_path:
+            return None
+
+        try:
+            manifest = self._manifests[source]
+        except KeyError:
+            manifest = self._load_manifest(source)
+            with self._lock:
+                manifest = self._manifests.setdefault(source, manifest)
+
+        if manifest is None:
+            return None
+        return manifest['types'].get(type, [])
+
+    def _load_manifest(self, source):
+        """ Load the manifest from the given source, if there is one. """
+        if not path.exists(MANIFEST_FILE, source=source):
+            return None
+
+        # Manifests are marshalled plain data, so loading one never runs
+        # any code. Anything unexpected means it isn't usable.
+        try:
+            with path.open(MANIFEST_FILE, source=source) as file:
+                manifest = marshal.loads(file.read())
+        except (IOError, EOFError, ValueError, TypeError):
+            log.warning('Unable to load the add-on manifest from %r.' %
+                        source)
+            return None
+
+        if not isinstance(manifest, dict) or \
+                manifest.get('format') != MANIFEST_FORMAT:
+            log.warning('Ignoring the add-on manifest in %r. It was built by '
+                        'an incompatible version of siding.' % source)
+            return None
+
+        try:
+            types = {}
+            for type, entries in manifest['types'].iteritems():
+                types[type] = [(name, filepath, filedata, convert_information(
+                    OrderedDict((section, OrderedDict(options))
+                                for section, options in sections), name))
+                    for name, filepath, filedata, sections in entries]
+        except Exception:
+            log.warning('Ignoring the invalid add-on manifest in %r.' %
+                        source)
+            return None
+
+        log.debug('Using the add-on manifest in %r.' % source)
+        return {'format': MANIFEST_FORMAT, 'types': types}
+
     ##### Dependency and Inheritance Checking #################################
 
-    def check_dependencies(self, addon, _chain=tuple()):
+    def check_dependencies(self, addon):
         """
         Verify that the dependencies of the given addon are available and that
         their own dependencies are available, ensuring that it will be possible
         to load an addon, or any other action that requires dependencies.
+
+        Results are cached by the manager's :class:`DependencyGraph`, so
+        calling this repeatedly is cheap until :meth:`invalidate` is called.
         """
         type = getattr(addon, '_type_name', None)
         if not type in self._types:
             raise TypeError("Invalid add-on type %r." % addon.__class__)
 
-        # Update the chain.
-        new_chain = _chain + (addon.name,)
+        with tracing.span('dependencies', addon.name, type):
+            self.graph.check(addon)
 
-        # Iterate the requirements.
-        for dname, match in addon.requires:
-            if dname in new_chain:
-                raise DependencyError('Dependency loop: %r' % new_chain)
-
-            if dname == '__app__':
-                version = app_version()
-            else:
-                d_type, _, name = dname.rpartition(':')
-                if not d_type:
-                    d_type = type
-                if not d_type in self._types:
-                    raise DependencyError(
-                        'Invalid add-on type %r in dependency %r of add-on %r.'
-                            % (d_type, dname, addon.data['name']))
+    def load_order(self, type=None):
+        """
+        Return a list of add-ons, of the given type or types if ``type`` is
+        specified, sorted so that every add-on comes after the add-ons it
+        requires. Add-ons that are part of a dependency loop are included, but
+        in no particular order relative to each other.
+        """
+        if isinstance(type, (tuple, list)):
+            types = type
+        else:
+            types = [type] if type else None
 
-                # Get the dependency.
-                try:
-                    dinfo = self.get(d_type, name)
-                    if dinfo.is_blacklisted:
-                        raise DependencyError(
-                                'Dependency %r is blacklisted.' % dname)
+        return [self._addons[key[0]][key[1]] for key in self.graph.order
+                if types is None or key[0] in types]
 
-                    # Walk the dependency tree.
-                    self.check_dependencies(dinfo)
-                    version = dinfo.version
-                except KeyError:
-                    version = None
+    def invalidate(self, addon=None, structure=True):
+        """
+        Discard cached dependency information for the given add-on and every
+        add-on that depends upon it. This must be called whenever an add-on is
+        added or removed, or when its version, requirements, or blacklist
+        status change. If ``addon`` is None, all cached information is
+        discarded.
 
-            # Check the version.
-            if not match.test(version):
-                raise DependencyError(
-                    'Unsatisfied dependency: %s %s' % (dname, match))
+        If ``structure`` is False, the requirements of the add-on are assumed
+        to be unchanged and the dependency graph won't be rebuilt.
+        """
+        self.graph.invalidate(addon, structure)
 
     def check_inheritance(self, addon, _chain=tuple()):
         """
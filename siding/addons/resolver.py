@@ -0,0 +1,641 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+Selection of consistent add-on versions when several versions of each add-on
+are available, such as when updating. Example::
+
+    from siding.addons.resolver import Resolver
+
+    resolver = Resolver()
+    for type, name, version, requires in catalog:
+        resolver.add(type, name, version, requires)
+
+    for key, release in resolver.resolve([('plugin', 'foo')]).iteritems():
+        if not release.installed:
+            print 'Install %s %s' % (release.name, release.version)
+
+The resolver picks the newest version of every requested add-on that can be
+used along with the other add-ons, while keeping installed add-ons that
+weren't requested at their current version where possible. Installed add-ons
+that depend on a requested add-on are checked as well, so an update never
+breaks them.
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+from siding.addons.manager import DependencyError, app_version, manager
+from siding.addons.version import Version, VersionMatch
+
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.addons')
+
+###############################################################################
+# Exceptions
+###############################################################################
+
+class ResolutionError(DependencyError):
+    """
+    This exception is raised by :meth:`Resolver.resolve` when there is no set
+    of versions that satisfies every requirement.
+    """
+    pass
+
+###############################################################################
+# The Release Class
+###############################################################################
+
+class Release(object):
+    """
+    A single version of an add-on that the :class:`Resolver` may select.
+    ``requires`` maps dependency names to :class:`VersionMatch` instances,
+    just like :attr:`AddonInfo.requires`, and ``data`` is whatever was
+    provided when the release was added, such as a download location. For
+    installed add-ons, ``data`` is the :class:`AddonInfo` instance.
+    """
+    __slots__ = ('type', 'name', 'version', 'requires', 'data', 'installed')
+
+    def __init__(self, type, name, version, requires=None, data=None,
+                 installed=False):
+        if not isinstance(version, Version):
+            version = Version(version)
+
+        self.type = type
+        self.name = name
+        self.version = version
+        self.requires = requires or {}
+        self.data = data
+        self.installed = installed
+
+    def __repr__(self):
+        return '<Release(%s:%s %s%s)>' % (self.type, self.name, self.version,
+                                          ' installed' if self.installed
+                                          else '')
+
+###############################################################################
+# The Resolver Class
+###############################################################################
+
+class Resolver(object):
+    """
+    This class finds a set of add-on versions that satisfies every
+    ``Requires`` rule, including rules for ``__app__``, by searching through
+    the available releases with backtracking.
+
+    When a choice fails, the resolver works out which earlier choices caused
+    the failure and jumps straight back to the most recent of them. The
+    failing combination is remembered, so it's never tried again.
+
+    ===========  ============
+    Argument     Description
+    ===========  ============
+    manager      The :class:`AddonManager` to read installed add-ons from. Set this to None to ignore installed add-ons.
+    app_version  The application version to test ``__app__`` rules against. By default, this is detected when needed.
+    ===========  ============
+    """
+
+    def __init__(self, manager=manager, app_version=None):
+        self.manager = manager
+        self.app_version = app_version
+        self._releases = {}
+        self._installed = {}
+
+        if manager is not None:
+            for type, addons in manager._addons.iteritems():
+                for name, addon in addons.iteritems():
+                    self._installed[(type, name)] = Release(
+                        type, name, addon.version, addon.requires, addon,
+                        installed=True)
+
+    ##### Releases ############################################################
+
+    def add(self, type, name, version, requires=None, data=None):
+        """
+        Make a release of an add-on available. ``requires`` should map
+        dependency names to :class:`VersionMatch` instances or rule strings.
+        Returns the new :class:`Release`.
+        """
+        if requires:
+            requires = dict((dname, match if isinstance(match, VersionMatch)
+                                    else VersionMatch(match))
+                            for dname, match in requires.iteritems())
+
+        release = Release(type, name, version, requires, data)
+        self._releases.setdefault((type, name), {})[release.version] = release
+        return release
+
+    def releases(self, type, name):
+        """
+        Return a list of every known release of the given add-on, including
+        the installed version, sorted from newest to oldest.
+        """
+        key = (type, name)
+        releases = dict(self._releases.get(key, {}))
+
+        # An installed release replaces a release with the same version, as
+        # there's nothing to download.
+        installed = self._installed.get(key)
+        if installed is not None:
+            releases[installed.version] = installed
+
+        versions = Version.sort_many(releases, reverse=True)
+        return [releases[version] for version in versions]
+
+    ##### Resolution ##########################################################
+
+    def resolve(self, updates, type=None):
+        """
+        Select a release for every requested add-on and everything it needs.
+        ``updates`` is a list of :class:`AddonInfo` instances, ``(type, name)``
+        tuples, or ``type:name`` strings. Plain names use the given type.
+
+        Returns a dict mapping ``(type, name)`` to the selected
+        :class:`Release`. A :class:`ResolutionError` is raised if there's no
+        way to satisfy every requirement.
+        """
+        requested = []
+        for update in updates:
+            if hasattr(update, '_type_name'):
+                key = (update._type_name, update.name)
+            elif isinstance(update, basestring):
+                key = self._key(update, type)
+            else:
+                key = tuple(update)
+            if not key in requested:
+                requested.append(key)
+
+        search = _Search(self, requested)
+        result = search.run()
+        log.debug('Resolved %d add-ons in %d steps.' % (len(result),
+                                                       search.steps))
+        return result
+
+    def _key(self, dname, type):
+        """ Return the ``(type, name)`` key of the named dependency. """
+        d_type, _, name = dname.rpartition(':')
+        return (d_type or type, name)
+
+    def _test_app(self, match):
+        """ Return True if the application version satisfies the match. """
+        if self.app_version is None:
+            self.app_version = app_version()
+        return match.test(self.app_version)
+
+###############################################################################
+# The Search
+###############################################################################
+
+class _Search(object):
+    """
+    The state of a single call to :meth:`Resolver.resolve`.
+
+    Every release is a literal that is either chosen or not, and the rules are
+    clauses of literals where at least one must hold. Requested add-ons and
+    installed add-ons that are affected by the update must have a release
+    chosen. Other add-ons only need one once something requires them.
+
+    The search picks the preferred release of an add-on that still needs one
+    and follows the consequences. When that leads to a conflict, the choices
+    responsible are worked out and stored as a new clause, so that the same
+    combination is never tried again, and the search jumps back to the most
+    recent of those choices.
+    """
+
+    def __init__(self, resolver, requested):
+        self.resolver = resolver
+        self.requested = set(requested)
+        self.steps = 0
+
+        self._candidates = {}
+        self._requires = {}
+
+        self.mandatory = self._find_mandatory(requested)
+
+    ##### Setup ###############################################################
+
+    def _find_mandatory(self, requested):
+        """
+        Work out which add-ons must be given a value. That's the requested
+        add-ons, plus any installed add-ons that depend on an add-on that may
+        change, since they have to keep working.
+        """
+        resolver = self.resolver
+        installed = resolver._installed
+
+        # Every add-on that may change, because it's reachable from the
+        # requested add-ons through any release.
+        reachable = set()
+        pending = list(requested)
+        while pending:
+            key = pending.pop()
+            if key in reachable:
+                continue
+            reachable.add(key)
+            for release in self.candidates(key):
+                pending.extend(dep for dep, match in self.requires(release)
+                               if dep is not None)
+
+        # Installed add-ons that depend on any of those.
+        dependants = {}
+        for key, release in installed.iteritems():
+            for dep, match in self.requires(release):
+                if dep is not None:
+                    dependants.setdefault(dep, []).append(key)
+
+        mandatory = []
+        seen = set()
+        pending = list(requested) + [key for key in reachable
+                                     if key in installed]
+        while pending:
+            key = pending.pop(0)
+            if key in seen:
+                continue
+            seen.add(key)
+            if key in requested or key in installed:
+                mandatory.append(key)
+            pending.extend(dependants.get(key, ()))
+
+        return mandatory
+
+    def candidates(self, key):
+        """ Return the releases for the add-on, in order of preference. """
+        try:
+            return self._candidates[key]
+        except KeyError:
+            pass
+
+        releases = self.resolver.releases(*key)
+        installed = self.resolver._installed.get(key)
+        if installed is not None and not key in self.requested:
+            # Try to leave add-ons that weren't requested alone.
+            releases.remove(installed)
+            releases.insert(0, installed)
+
+        # Releases that can't work with this application are left out now.
+        test_app = self.resolver._test_app
+        releases = [release for release in releases if
+                    all(test_app(match) for dep, match in
+                        self.requires(release) if dep is None)]
+
+        self._candidates[key] = releases
+        return releases
+
+    def requires(self, release):
+        """
+        Return a list of ``(key, match)`` for the release's requirements. The
+        key is None for ``__app__``.
+        """
+        try:
+            return self._requires[release]
+        except KeyError:
+            pass
+
+        out = []
+        for dname, match in release.requires.iteritems():
+            if dname == '__app__':
+                out.append((None, match))
+            else:
+                out.append((self.resolver._key(dname, release.type), match))
+
+        self._requires[release] = out
+        return out
+
+    ##### Clauses #############################################################
+
+    def _build(self):
+        """
+        Number every release of every add-on that may be involved, and build
+        the clauses the choices must satisfy. Literals are release numbers,
+        negated when the release is *not* chosen.
+        """
+        self.releases = [None]
+        self.keys = [None]
+        self.literals = {}
+        self.clauses = []
+        self.watches = {}
+        self.required = {}
+
+        # Everything reachable from the add-ons that need values.
+        pending = list(self.mandatory)
+        while pending:
+            key = pending.pop()
+            if key in self.literals:
+                continue
+            literals = self.literals[key] = []
+            for release in self.candidates(key):
+                literals.append(len(self.releases))
+                self.releases.append(release)
+                self.keys.append(key)
+                pending.extend(dep for dep, match in self.requires(release)
+                               if dep is not None)
+
+        units = []
+
+        # Add-ons that need a value must have one of their releases chosen.
+        for key in self.mandatory:
+            if not self.literals[key]:
+                raise ResolutionError('No usable release of %s:%s is '
+                                      'available.' % key)
+            units.append(self._add_clause(list(self.literals[key])))
+
+        # A release being chosen means one of the releases allowed by each of
+        # its requirements must be chosen too.
+        for literal in xrange(1, len(self.releases)):
+            release = self.releases[literal]
+            required = self.required[literal] = []
+            for dep, match in self.requires(release):
+                if dep is None:
+                    continue
+                options = [other for other in self.literals[dep] if
+                           match.test(self.releases[other].version)]
+                units.append(self._add_clause([-literal] + options))
+                required.append((dep, options))
+
+        return units
+
+    def _add_clause(self, clause):
+        """
+        Store the clause, watching its first two literals, and return its
+        index.
+        """
+        index = len(self.clauses)
+        self.clauses.append(clause)
+        if len(clause) > 1:
+            for literal in clause[:2]:
+                self.watches.setdefault(literal, []).append(index)
+        return index
+
+    def _value(self, literal):
+        """ Return True, False, or None if the literal isn't assigned. """
+        value = self.values[abs(literal)]
+        if value is None or literal > 0:
+            return value
+        return not value
+
+    ##### Searching ###########################################################
+
+    def run(self):
+        """ Run the search, returning the selected releases. """
+        units = self._build()
+
+        count = len(self.releases)
+        self.values = [None] * count
+        self.levels = [0] * count
+        self.reasons = [None] * count
+        self.trail = []
+        self.limits = []
+        self.head = 0
+        self.chosen = {}
+        self.scanned = self.satisfied = 0
+        self._exclusions = {}
+
+        # Clauses that are already decided at the start.
+        for index in units:
+            clause = self.clauses[index]
+            if len(clause) == 1:
+                value = self._value(clause[0])
+                if value is False:
+                    self._fail(index)
+                elif value is None:
+                    self._enqueue(clause[0], index)
+
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                if not self.limits:
+                    self._fail(conflict)
+                self._learn(conflict)
+                continue
+
+            literal = self._decide()
+            if literal is None:
+                break
+
+            self.steps += 1
+            self.limits.append(len(self.trail))
+            self._enqueue(literal, None)
+
+        return dict((self.keys[literal], self.releases[literal])
+                    for literal in self.trail if literal > 0)
+
+    def _enqueue(self, literal, reason):
+        index = abs(literal)
+        self.values[index] = literal > 0
+        self.levels[index] = len(self.limits)
+        self.reasons[index] = reason
+        self.trail.append(literal)
+        if literal > 0:
+            self.chosen.setdefault(self.keys[literal], literal)
+
+    def _propagate(self):
+        """
+        Assign every literal forced by the current choices. Returns the index
+        of a clause that can't be satisfied, or None.
+        """
+        clauses = self.clauses
+        while self.head < len(self.trail):
+            literal = self.trail[self.head]
+            self.head += 1
+
+            # Only one release of each add-on may be chosen.
+            if literal > 0:
+                conflict = self._exclude(literal)
+                if conflict is not None:
+                    return conflict
+
+            false = -literal
+            watching = self.watches.get(false)
+            if not watching:
+                continue
+
+            kept = []
+            for position, index in enumerate(watching):
+                clause = clauses[index]
+                if clause[0] == false:
+                    clause[0], clause[1] = clause[1], false
+
+                if self._value(clause[0]) is True:
+                    kept.append(index)
+                    continue
+
+                # Look for another literal to watch.
+                for other in xrange(2, len(clause)):
+                    if self._value(clause[other]) is not False:
+                        clause[1], clause[other] = clause[other], false
+                        self.watches.setdefault(clause[1], []).append(index)
+                        break
+                else:
+                    kept.append(index)
+                    if self._value(clause[0]) is False:
+                        kept.extend(watching[position + 1:])
+                        self.watches[false] = kept
+                        return index
+                    self._enqueue(clause[0], index)
+
+            self.watches[false] = kept
+
+        return None
+
+    def _exclude(self, literal):
+        """
+        Rule out the other releases of the add-on of a chosen release.
+        Returns the index of a clause that can't be satisfied, or None.
+        """
+        for other in self.literals[self.keys[literal]]:
+            if other == literal:
+                continue
+            value = self.values[other]
+            if value is False:
+                continue
+
+            # The reason is stored as a clause, so conflicts can be explained.
+            pair = (literal, other) if literal < other else (other, literal)
+            index = self._exclusions.get(pair)
+            if index is None:
+                index = self._exclusions[pair] = len(self.clauses)
+                self.clauses.append([-other, -literal])
+            else:
+                clause = self.clauses[index]
+                if clause[0] != -other:
+                    clause[0], clause[1] = clause[1], clause[0]
+
+            if value is True:
+                return index
+            self._enqueue(-other, index)
+
+    def _learn(self, conflict):
+        """
+        Work out which choices caused the conflict, remember that they can't
+        be made together, and go back to before the most recent of them.
+        """
+        level = len(self.limits)
+        seen = set()
+        learnt = [None]
+        count = 0
+        literal = None
+        position = len(self.trail) - 1
+        clause = self.clauses[conflict]
+
+        while True:
+            for other in clause:
+                if other == literal:
+                    continue
+                index = abs(other)
+                if index in seen or not self.levels[index]:
+                    continue
+                seen.add(index)
+                if self.levels[index] == level:
+                    count += 1
+                else:
+                    learnt.append(other)
+
+            # Step back to the last literal involved in the conflict.
+            while abs(self.trail[position]) not in seen:
+                position -= 1
+            literal = self.trail[position]
+            position -= 1
+            count -= 1
+            if not count:
+                break
+            clause = self.clauses[self.reasons[abs(literal)]]
+
+        learnt[0] = -literal
+
+        # Go back to the level where the learnt clause forces a choice.
+        target = 0
+        if len(learnt) > 1:
+            best = max(xrange(1, len(learnt)),
+                       key=lambda i: self.levels[abs(learnt[i])])
+            learnt[1], learnt[best] = learnt[best], learnt[1]
+            target = self.levels[abs(learnt[1])]
+
+        self._backtrack(target)
+        self._enqueue(learnt[0], self._add_clause(learnt))
+
+    def _backtrack(self, level):
+        """ Undo every choice made after the given level. """
+        if len(self.limits) <= level:
+            return
+        size = self.limits[level]
+        for literal in self.trail[size:]:
+            index = abs(literal)
+            self.values[index] = None
+            self.reasons[index] = None
+            if literal > 0 and self.chosen.get(self.keys[literal]) == literal:
+                del self.chosen[self.keys[literal]]
+        del self.trail[size:]
+        del self.limits[level:]
+        self.head = size
+
+        # Requirements may need choices again.
+        self.scanned = self.satisfied = 0
+
+    def _decide(self):
+        """
+        Return the preferred release for the first add-on that still needs
+        one, or None if everything is satisfied.
+        """
+        # Add-ons that need a value. Those already chosen stay chosen until
+        # the search backtracks, so they aren't checked again until then.
+        mandatory = self.mandatory
+        while self.satisfied < len(mandatory):
+            key = mandatory[self.satisfied]
+            if not key in self.chosen:
+                return self._open(self.literals[key])
+            self.satisfied += 1
+
+        # The requirements of chosen releases, in the order they were chosen.
+        trail = self.trail
+        while self.scanned < len(trail):
+            chosen = trail[self.scanned]
+            if chosen > 0:
+                for dep, options in self.required[chosen]:
+                    if not dep in self.chosen:
+                        return self._open(options)
+            self.scanned += 1
+
+    def _open(self, literals):
+        """ Return the first of the literals that hasn't been ruled out. """
+        values = self.values
+        for literal in literals:
+            if values[literal] is None:
+                return literal
+
+    def _fail(self, index):
+        """ Raise a ResolutionError explaining the failed clause. """
+        keys = set()
+        pending = [index]
+        seen = set()
+        while pending:
+            index = pending.pop()
+            if index is None or index in seen:
+                continue
+            seen.add(index)
+            for literal in self.clauses[index]:
+                keys.add(self.keys[abs(literal)])
+                pending.append(self.reasons[abs(literal)])
+
+        names = sorted('%s:%s' % key for key in keys) or \
+                sorted('%s:%s' % key for key in self.requested)
+        raise ResolutionError('Unable to find compatible versions of: %s' %
+                              ', '.join(names))
@@ -0,0 +1,383 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+Background update checks, run with an
+:class:`~siding.addons.updater.IUpdater` while the application is idle::
+
+    updater = HTTPUpdater(siding.addons.manager, 'http://example.com/updates')
+    scheduler = UpdateScheduler(updater, interval=86400)
+    scheduler.start()
+
+The scheduler does nothing until ``startup_delay`` seconds after it's
+started. After that, it only starts checks once the event loop has been
+responsive, and there's been no keyboard or mouse input, for ``idle_time``
+seconds. The time of each add-on's last check is stored in the profile, so
+restarting the application doesn't cause every add-on to be checked again.
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+import random
+import time
+
+from PySide.QtCore import QCoreApplication, QEvent, QObject, QTimer, Slot
+
+from siding import profile
+from siding.addons.base import AddonInfo
+
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.addons')
+
+###############################################################################
+# Constants
+###############################################################################
+
+PROFILE_GROUP = 'siding/addons/updates/%s/%s'
+
+INPUT_EVENTS = frozenset((
+    QEvent.KeyPress, QEvent.KeyRelease, QEvent.MouseButtonPress,
+    QEvent.MouseButtonRelease, QEvent.MouseButtonDblClick,
+    QEvent.MouseMove, QEvent.Wheel, QEvent.TouchBegin, QEvent.TouchUpdate,
+    ))
+
+###############################################################################
+# InputMonitor Class
+###############################################################################
+
+class InputMonitor(QObject):
+    """
+    An event filter for the application that remembers when the user last
+    used the keyboard or mouse.
+    """
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.last_input = 0
+
+    def eventFilter(self, obj, event):
+        if event.type() in INPUT_EVENTS:
+            self.last_input = time.time()
+        return False
+
+###############################################################################
+# UpdateScheduler Class
+###############################################################################
+
+class UpdateScheduler(QObject):
+    """
+    Checks for updates to add-ons in the background, when the application is
+    idle. Each add-on is checked every ``interval`` seconds, give or take a
+    random ``jitter`` so that checks don't all come due at once.
+
+    If a check fails, the add-on is tried again after ``backoff`` seconds,
+    doubling with every failure after that, up to ``interval``. Add-ons that
+    are due are checked in batches of ``batch_size`` with
+    :meth:`~siding.addons.updater.IUpdater.check_updates`, and no more than
+    ``max_active`` batches are ever running at once.
+
+    ================  ============  ============
+    Argument          Default       Description
+    ================  ============  ============
+    updater                         The :class:`~siding.addons.updater.IUpdater` to check with.
+    interval          ``86400``     How many seconds to wait between checks of each add-on.
+    jitter            ``0.1``       How much to randomly vary the interval by, as a fraction of it.
+    backoff           ``600``       How many seconds to wait after the first failed check of an add-on.
+    startup_delay     ``60``        How many seconds to wait after :meth:`start` before checking anything.
+    idle_time         ``2``         How many seconds the application must be idle for before checks start.
+    max_active        ``1``         The most batches of checks to have running at once.
+    batch_size        ``50``        The most add-ons to check at once.
+    addons                          *Optional.* A function returning the add-ons to check. By default, every add-on known to the Add-on Manager is checked.
+    ================  ============  ============
+    """
+
+    # How many times during ``idle_time`` to make sure the event loop is
+    # responsive, and how late a timer may be and still count as on time.
+    PROBES = 4
+    SLACK = 0.1
+
+    def __init__(self, updater, interval=86400, jitter=0.1, backoff=600,
+                 startup_delay=60, idle_time=2, max_active=1, batch_size=50,
+                 addons=None):
+        QObject.__init__(self)
+
+        self.updater = updater
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff = backoff
+        self.startup_delay = startup_delay
+        self.idle_time = idle_time
+        self.max_active = max_active
+        self.batch_size = batch_size
+        self._addons = addons
+
+        # The schedule of each add-on, by (type, name), as a list of
+        # [last_check, next_check, failures].
+        self._schedule = {}
+
+        # The add-ons of each running batch, and the batch of each add-on.
+        self._batches = []
+        self._active = {}
+
+        self._running = False
+        self._expected = None
+        self._probes = 0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._on_timer)
+
+        self._monitor = None
+
+        updater.update_available.connect(self._on_available)
+        updater.update_finished.connect(self._on_finished)
+        updater.update_error.connect(self._on_error)
+
+    ##### Control #############################################################
+
+    def start(self):
+        """ Start checking for updates, after the startup delay. """
+        if self._running:
+            return
+        self._running = True
+
+        app = QCoreApplication.instance()
+        if app is not None and self._monitor is None:
+            self._monitor = InputMonitor(self)
+            app.installEventFilter(self._monitor)
+
+        self._arm(self.startup_delay)
+
+    def stop(self):
+        """
+        Stop starting new checks. Checks that are already running are left
+        to finish.
+        """
+        self._running = False
+        self._timer.stop()
+
+        if self._monitor is not None:
+            app = QCoreApplication.instance()
+            if app is not None:
+                app.removeEventFilter(self._monitor)
+            self._monitor = None
+
+    @property
+    def is_running(self):
+        """ Whether or not the scheduler has been started. """
+        return self._running
+
+    ##### Schedule ############################################################
+
+    def last_check(self, addon):
+        """
+        Return the time of the last successful check of the add-on, as
+        seconds since the epoch, or None if it's never been checked.
+        """
+        return self._entry(addon)[0]
+
+    def next_check(self, addon):
+        """ Return the time that the add-on is next due to be checked. """
+        return self._entry(addon)[1]
+
+    def failures(self, addon):
+        """ Return how many checks of the add-on have failed in a row. """
+        return self._entry(addon)[2]
+
+    def due(self, now=None):
+        """
+        Return a list of the add-ons that are due to be checked and aren't
+        being checked already, with the most overdue first.
+        """
+        now = time.time() if now is None else now
+        addons = self._addons() if self._addons else self._all_addons()
+
+        due = []
+        for addon in addons:
+            key = (addon._type_name, addon.name)
+            if key in self._active:
+                continue
+            next = self._entry(addon)[1]
+            if next <= now:
+                due.append((next, addon))
+
+        due.sort(key=lambda item: item[0])
+        return [addon for next, addon in due]
+
+    def _all_addons(self):
+        from siding.addons.manager import manager
+        return manager.find()
+
+    def _entry(self, addon):
+        """ Return the schedule of the add-on, loading it if needed. """
+        key = (addon._type_name, addon.name)
+        entry = self._schedule.get(key)
+        if entry is None:
+            entry = self._schedule[key] = self._load(key)
+        return entry
+
+    def _load(self, key):
+        """ Read the schedule of an add-on from the profile. """
+        last, next, failures = None, 0, 0
+        if profile.settings is not None:
+            values = profile.group(PROFILE_GROUP % key)
+            try:
+                if values.get('last_check'):
+                    last = float(values['last_check'])
+                next = float(values.get('next_check') or 0)
+                failures = int(values.get('failures') or 0)
+            except (TypeError, ValueError):
+                log.debug('Ignoring invalid update schedule for %s: %s.' %
+                          key)
+        return [last, next, failures]
+
+    def _save(self, key, entry):
+        """ Store the schedule of an add-on in the profile. """
+        self._schedule[key] = entry
+        if profile.settings is None:
+            return
+
+        group = PROFILE_GROUP % key
+        last, next, failures = entry
+        if last is not None:
+            profile.set(group + '/last_check', last)
+        profile.set(group + '/next_check', next)
+        profile.set(group + '/failures', failures)
+
+    def _delay(self, seconds):
+        """ Vary a delay by the jitter. """
+        if not self.jitter:
+            return seconds
+        return seconds * (1 + random.uniform(-self.jitter, self.jitter))
+
+    ##### Idle Detection ######################################################
+
+    def _arm(self, delay):
+        """ Fire the timer in ``delay`` seconds. """
+        delay = max(0, delay)
+        self._expected = time.time() + delay
+        self._timer.start(int(delay * 1000))
+
+    def _is_idle(self, now):
+        """
+        Return True if the timer fired on time and nobody has used the
+        keyboard or mouse for ``idle_time`` seconds.
+        """
+        if self._expected is not None and now - self._expected > self.SLACK:
+            return False
+        if self._monitor is not None and \
+                now - self._monitor.last_input < self.idle_time:
+            return False
+        return True
+
+    @Slot()
+    def _on_timer(self):
+        if not self._running:
+            return
+
+        now = time.time()
+        if not self._is_idle(now):
+            self._probes = 0
+        else:
+            self._probes += 1
+
+        # Make sure things stay idle for a while, without waking up
+        # constantly when there's nothing to do.
+        if self._probes < self.PROBES:
+            self._arm(float(self.idle_time) / self.PROBES)
+            return
+
+        self._probes = 0
+        self._run(now)
+        self._reschedule(now)
+
+    def _run(self, now):
+        """ Start as many batches of due checks as we're allowed to. """
+        due = self.due(now)
+        while due and len(self._batches) < self.max_active:
+            batch, due = due[:self.batch_size], due[self.batch_size:]
+            keys = set((addon._type_name, addon.name) for addon in batch)
+            self._batches.append(keys)
+            for key in keys:
+                self._active[key] = keys
+
+            log.debug('Checking %d add-ons for updates.' % len(batch))
+            self.updater.check_updates(batch)
+
+    def _reschedule(self, now=None):
+        """ Arm the timer for the next add-on to come due. """
+        if not self._running or len(self._batches) >= self.max_active:
+            # A batch finishing will call us again.
+            return
+
+        # Idleness has to be seen again after the wait.
+        self._probes = 0
+
+        now = time.time() if now is None else now
+        upcoming = [entry[1] for key, entry in self._schedule.iteritems()
+                    if key not in self._active]
+
+        # Add-ons we've never seen can only be found by asking again, so
+        # don't wait longer than the backoff.
+        delay = self.backoff
+        if upcoming:
+            delay = min(delay, min(upcoming) - now)
+        self._arm(max(delay, float(self.idle_time) / self.PROBES))
+
+    ##### Results #############################################################
+
+    def _done(self, addon, failed):
+        key = (addon._type_name, addon.name)
+        batch = self._active.pop(key, None)
+        if batch is None:
+            # This isn't a check we started.
+            return
+
+        now = time.time()
+        last, next, failures = self._entry(addon)
+        if failed:
+            failures += 1
+            next = now + self._delay(min(self.interval,
+                                         self.backoff * 2 ** (failures - 1)))
+        else:
+            last, failures = now, 0
+            next = now + self._delay(self.interval)
+        self._save(key, [last, next, failures])
+
+        batch.discard(key)
+        if not batch:
+            self._batches.remove(batch)
+            if not self._timer.isActive():
+                self._reschedule(now)
+
+    @Slot(AddonInfo, str)
+    def _on_available(self, addon, version):
+        self._done(addon, False)
+
+    @Slot(AddonInfo, bool)
+    def _on_finished(self, addon, updated):
+        self._done(addon, False)
+
+    @Slot(AddonInfo, object)
+    def _on_error(self, addon, error):
+        self._done(addon, True)
@@ -0,0 +1,182 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+Timing events for the add-on system, to find out where start up time goes.
+Tracing is disabled by default, and costs next to nothing until it's enabled.
+Example::
+
+    from siding.addons import tracing
+    tracing.enable()
+
+    siding.plugins.initialize(True)
+
+    for category, names in tracing.timings().iteritems():
+        for name, (count, seconds) in names.iteritems():
+            print '%s %s: %d in %.3fs' % (category, name, count, seconds)
+
+    tracing.export('startup.json')
+
+The following categories of event are recorded:
+
+==============  ============
+Category        Description
+==============  ============
+discover        Searching one source for add-ons. The name is the source.
+parse           Reading an add-on's information file.
+dependencies    Checking an add-on's dependencies.
+import          Importing a plugin's module.
+instantiate     Creating a plugin's :class:`~siding.plugins.IPlugin` instance.
+activate        Activating a plugin.
+deactivate      Deactivating a plugin.
+==============  ============
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+import json
+import os
+import thread
+
+from collections import OrderedDict
+from timeit import default_timer as clock
+
+###############################################################################
+# Storage
+###############################################################################
+
+enabled = False
+_events = []
+_start = clock()
+
+###############################################################################
+# Spans
+###############################################################################
+
+class _NullSpan(object):
+    """ The span used when tracing is disabled. It does nothing. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_span = _NullSpan()
+
+class _Span(object):
+    """ A span that records a timing event when it's exited. """
+    __slots__ = ('category', 'name', 'detail', 'start')
+
+    def __init__(self, category, name, detail):
+        self.category = category
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _events.append((self.category, self.name, self.detail, self.start,
+                        clock() - self.start, thread.get_ident()))
+        return False
+
+def span(category, name, detail=None):
+    """
+    Return a context manager that records the time spent within it as an
+    event of the given category and name, if tracing is enabled. ``detail``
+    may be any additional string to store with the event.
+    """
+    if not enabled:
+        return _null_span
+    return _Span(category, name, detail)
+
+###############################################################################
+# Control
+###############################################################################
+
+def enable(value=True):
+    """ Enable, or if ``value`` is False, disable tracing. """
+    global enabled
+    enabled = bool(value)
+
+def disable():
+    """ Disable tracing. Recorded events are kept. """
+    enable(False)
+
+def clear():
+    """ Discard all recorded events. """
+    del _events[:]
+
+###############################################################################
+# Reporting
+###############################################################################
+
+def events():
+    """
+    Return a list of every recorded event, as tuples of
+    ``(category, name, detail, start, duration, thread_id)``. Times are in
+    seconds.
+    """
+    return list(_events)
+
+def timings():
+    """
+    Return an :class:`~collections.OrderedDict`, with a key for every
+    category of event, of dictionaries mapping names to a tuple of
+    ``(count, total_seconds)``.
+    """
+    output = OrderedDict()
+    for category, name, detail, start, duration, tid in _events:
+        names = output.setdefault(category, {})
+        count, total = names.get(name, (0, 0.0))
+        names[name] = count + 1, total + duration
+    return output
+
+def _text(value):
+    """ Convert the given value to unicode for JSON. """
+    if isinstance(value, unicode):
+        return value
+    return str(value).decode('utf-8', 'replace')
+
+def export(filename):
+    """
+    Write every recorded event to the given file, in the Trace Event format
+    understood by Chrome's ``about:tracing`` and similar tools.
+    """
+    trace = []
+    pid = os.getpid()
+    for category, name, detail, start, duration, tid in _events:
+        event = {
+            'name': _text(name),
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start - _start) * 1000000),
+            'dur': int(duration * 1000000),
+            'pid': pid,
+            'tid': tid,
+        }
+        if detail is not None:
+            event['args'] = {'detail': _text(detail)}
+        trace.append(event)
+
+    with open(filename, 'wb') as file:
+        json.dump({'traceEvents': trace}, file)
@@ -17,16 +17,41 @@
 ###############################################################################
 """
 A basic interface for a class to allow add-ons to be updated automatically and
-entirely within the application.
+entirely within the application, and an implementation of it that fetches
+updates over HTTP.
 """
 
 ###############################################################################
 # Imports
 ###############################################################################
 
-from PySide.QtCore import QObject, Signal
+import hashlib
+import httplib
+import json
+import os
+import posixpath
+import re
+import shutil
+import socket
+import threading
+import time
+import urllib
+import urlparse
+import zipfile
+
+from PySide.QtCore import QObject, QRunnable, QThreadPool, Qt, Signal, Slot
 
 from siding.addons.base import AddonInfo
+from siding.addons.manager import app_version
+from siding.addons.version import Version, VersionMatch
+from siding import path, profile
+
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.addons')
 
 ###############################################################################
 # IUpdater Class
@@ -78,6 +103,13 @@ class IUpdater(QObject):
     user that their add-on will be updated when the application is restarted.
     """
 
+    update_available = Signal(AddonInfo, str)
+    """
+    This signal is emitted when a check started with :meth:`can_update` finds
+    a newer version of an add-on. The arguments to this signal are
+    ``(addon_info, version)``. Call :meth:`do_update` to install it.
+    """
+
     update_error = Signal((AddonInfo, object), (AddonInfo, str))
     """
     This signal is emitted whenever an error occurs while waiting for an
@@ -122,6 +154,22 @@ class IUpdater(QObject):
                 NotImplementedError('An updater is not installed.')
             )
 
+    def check_updates(self, addons):
+        """
+        Begin checking for updates to many add-ons at once. The same signals
+        are emitted for each add-on as with :meth:`can_update`. By default,
+        this just calls :meth:`can_update` for every add-on, but updaters
+        should override it when they can check for many add-ons at once.
+
+        =========  ============
+        Argument   Description
+        =========  ============
+        addons     A list of :class:`AddonInfo` instances.
+        =========  ============
+        """
+        for addon in addons:
+            self.can_update(addon)
+
     def do_update(self, addon):
         """
         Begin downloading and installing an update for the provided add-on.
@@ -139,3 +187,973 @@ class IUpdater(QObject):
                 addon,
                 NotImplementedError('An updater is not installed.')
             )
+
+###############################################################################
+# Helpers
+###############################################################################
+
+CHUNK_SIZE = 65536
+RETRIES = 3
+STAGING_FOLDER = '.updates'
+
+def _hash_file(file):
+    """ Return the SHA-256 hash of an open file, read in chunks. """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def _manifest_parts(name):
+    """
+    Split a path from a file manifest into its parts, raising an IOError if
+    it would point outside of the add-on.
+    """
+    parts = [part for part in name.split('/') if part and part != '.']
+    if not parts or '..' in parts or name.startswith('/') or ':' in name:
+        raise IOError('Invalid path in file manifest: %r' % name)
+    return parts
+
+###############################################################################
+# Connection Pool
+###############################################################################
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP connections. No more than ``size``
+    connections are ever open at once. Threads wanting a connection when
+    they're all busy wait for one to be released.
+    """
+
+    def __init__(self, size=8, timeout=30):
+        self.size = size
+        self.timeout = timeout
+
+        self._idle = {}
+        self._count = 0
+        self._condition = threading.Condition()
+
+    def _acquire(self, origin):
+        """ Return an idle connection to the origin, or a new one. """
+        with self._condition:
+            while True:
+                idle = self._idle.get(origin)
+                if idle:
+                    return idle.pop()
+
+                if self._count < self.size:
+                    self._count += 1
+                    break
+
+                # Close an idle connection to somewhere else to make room.
+                for connections in self._idle.itervalues():
+                    if connections:
+                        connections.pop().close()
+                        break
+                else:
+                    self._condition.wait()
+                    continue
+                break
+
+        scheme, host, port = origin
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _release(self, origin, connection, reuse=True):
+        """ Return a connection to the pool, or close it. """
+        with self._condition:
+            if reuse:
+                self._idle.setdefault(origin, []).append(connection)
+            else:
+                connection.close()
+                self._count -= 1
+            self._condition.notify()
+
+    def request(self, method, url, headers=None, body=None, output=None):
+        """
+        Perform a request and return a tuple of ``(status, headers, body)``.
+        The header names are lower case. A request on a kept-alive connection
+        that the server has since closed is retried once on a new one.
+
+        If ``output`` is provided, it's called with the status and headers of
+        the response before the body is read. If it returns a function, the
+        body is passed to that function in chunks as it arrives, rather than
+        being returned. An error while streaming the body is never retried.
+        """
+        parts = urlparse.urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        for attempt in (0, 1):
+            connection = self._acquire(origin)
+            write = None
+            try:
+                connection.request(method, target, body, headers or {})
+                response = connection.getresponse()
+                response_headers = dict(response.getheaders())
+                if output is not None:
+                    write = output(response.status, response_headers)
+
+                if write is None:
+                    data = response.read()
+                else:
+                    data = ''
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), ''):
+                        write(chunk)
+
+                    # Reading in chunks doesn't notice the connection being
+                    # closed early, so check that everything arrived.
+                    if response.length:
+                        raise httplib.IncompleteRead('', response.length)
+
+            except (httplib.HTTPException, socket.error):
+                self._release(origin, connection, False)
+                if attempt or write is not None:
+                    raise
+                continue
+
+            except Exception:
+                self._release(origin, connection, False)
+                raise
+
+            self._release(origin, connection, not response.will_close)
+            return response.status, response_headers, data
+
+    def close(self):
+        """ Close every idle connection. """
+        with self._condition:
+            for connections in self._idle.itervalues():
+                for connection in connections:
+                    connection.close()
+                    self._count -= 1
+            self._idle.clear()
+            self._condition.notify_all()
+
+###############################################################################
+# Downloads and Staging
+###############################################################################
+
+class PartialFile(object):
+    """
+    The file a download is written to as it arrives, to be used as the
+    ``output`` of :meth:`ConnectionPool.request`. The SHA-256 hash is
+    computed as data is written. If the file already exists, the download
+    continues where it left off with a ``Range`` request. If ``progress`` is
+    provided, it's called with ``(done, total)`` after every chunk, where
+    ``total`` may be None.
+    """
+
+    def __init__(self, filename, progress=None):
+        self.filename = filename
+        self.progress = progress
+        self.digest = hashlib.sha256()
+        self.offset = 0
+        self.total = None
+        self._file = None
+
+        if os.path.exists(filename):
+            with open(filename, 'rb') as file:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+                    self.digest.update(chunk)
+                    self.offset += len(chunk)
+
+    def headers(self):
+        """ Return the headers to request the rest of the file with. """
+        if self.offset:
+            return {'Range': 'bytes=%d-' % self.offset}
+        return {}
+
+    def reset(self):
+        """ Throw away what's been downloaded so far. """
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.digest = hashlib.sha256()
+        self.offset = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __call__(self, status, headers):
+        if status == 206 and self.offset:
+            match = re.match(r'bytes (\d+)-\d+/(\d+|\*)',
+                             headers.get('content-range', ''))
+            if not match or int(match.group(1)) != self.offset:
+                raise IOError('Unexpected Content-Range for %s.' %
+                              self.filename)
+            if match.group(2) != '*':
+                self.total = int(match.group(2))
+            mode = 'ab'
+
+        elif status == 200:
+            # The server sent everything, so start over.
+            self.digest = hashlib.sha256()
+            self.offset = 0
+            if headers.get('content-length', '').isdigit():
+                self.total = int(headers['content-length'])
+            mode = 'wb'
+
+        else:
+            return None
+
+        self.close()
+        self._file = open(self.filename, mode)
+        return self.write
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.digest.update(chunk)
+        self.offset += len(chunk)
+        if self.progress:
+            self.progress(self.offset, self.total)
+
+class StagedUpdate(object):
+    """
+    A new version of an add-on, staged in a folder under the profile path
+    until the application is next started, when :func:`apply_updates` moves
+    it into place.
+
+    The files are relative to ``target``, a folder relative to the profile
+    path. If ``prefix`` is set, every file is within a folder of that name,
+    and that folder is swapped into place with a single rename.
+    """
+
+    def __init__(self, folder, target, prefix, version):
+        self.folder = folder
+        self.target = target
+        self.prefix = prefix
+        self.version = version
+
+    @property
+    def partial(self):
+        """ The folder the update is built in before it's complete. """
+        return self.folder + '.partial'
+
+    def begin(self):
+        """ Start building the update, and return the folder of its files. """
+        if os.path.exists(self.partial):
+            shutil.rmtree(self.partial)
+
+        files = os.path.join(self.partial, 'files')
+        if self.prefix:
+            files = os.path.join(files, self.prefix)
+        os.makedirs(files)
+        return files
+
+    def finish(self):
+        """
+        Mark the update as complete, replacing any update that was staged
+        earlier for the same add-on.
+        """
+        with open(os.path.join(self.partial, 'update.json'), 'wb') as file:
+            json.dump({'target': self.target, 'version': self.version}, file)
+
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+        os.rename(self.partial, self.folder)
+        return self.folder
+
+def apply_updates(root=None):
+    """
+    Move every update staged by :class:`HTTPUpdater` in the profile path
+    ``root`` into place, and return a list of ``(type, name, version)`` for
+    the updates applied. This is called by the Add-on Manager before it
+    first discovers add-ons, so there's no need to call it yourself.
+
+    Each top-level entry of an update is replaced with a rename. If the
+    application is closed part way through, the rest of the update is
+    applied on the next start.
+    """
+    root = root or profile.profile_path
+    staging = os.path.join(root, STAGING_FOLDER) if root else None
+    if not staging or not os.path.isdir(staging):
+        return []
+
+    applied = []
+    for type in sorted(os.listdir(staging)):
+        for name in sorted(os.listdir(os.path.join(staging, type))):
+            folder = os.path.join(staging, type, name)
+            if name.endswith('.partial'):
+                # An update that was never finished.
+                shutil.rmtree(folder, True)
+                continue
+
+            try:
+                with open(os.path.join(folder, 'update.json'), 'rb') as file:
+                    info = json.load(file)
+                target = os.path.join(root, *_manifest_parts(info['target']))
+
+                files = os.path.join(folder, 'files')
+                old = os.path.join(folder, 'old')
+                for entry in sorted(os.listdir(files)):
+                    dest = os.path.join(target, entry)
+                    if os.path.lexists(dest):
+                        if not os.path.exists(old):
+                            os.makedirs(old)
+                        os.rename(dest, os.path.join(old, entry))
+                    elif not os.path.exists(target):
+                        os.makedirs(target)
+                    os.rename(os.path.join(files, entry), dest)
+
+            except (IOError, OSError, ValueError, KeyError):
+                log.exception('Unable to apply the update to %s: %s.' % (
+                              type, name))
+                continue
+
+            shutil.rmtree(folder, True)
+            log.info('Updated %s: %s to version %s.' % (type, name,
+                                                        info.get('version')))
+            applied.append((type, name, info.get('version')))
+
+    return applied
+
+###############################################################################
+# Response Cache
+###############################################################################
+
+class ResponseCache(object):
+    """
+    Stores the responses to update checks on disk, along with their
+    validators, so that later checks can send conditional requests and reuse
+    the stored response when the server answers ``304 Not Modified``. The
+    SHA-256 hash of each response is stored too, and a response that no
+    longer matches it is thrown away.
+
+    If ``max_age`` is set, a stored response younger than that many seconds is
+    used without contacting the server at all.
+    """
+
+    def __init__(self, directory, max_age=0):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _key(self, method, url, body):
+        return hashlib.sha1('\0'.join((method, url, body or ''))).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key):
+        """
+        Return the stored entry for the key, as a tuple of ``(info, body)``,
+        or None if there isn't a valid one.
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename + '.json', 'rb') as file:
+                info = json.load(file)
+            with open(filename + '.body', 'rb') as file:
+                body = file.read()
+        except (IOError, ValueError):
+            return None
+
+        if hashlib.sha256(body).hexdigest() != info.get('sha256'):
+            log.debug('Discarding corrupt cached response for %s.' %
+                      info.get('url'))
+            return None
+        return info, body
+
+    def store(self, key, info, body):
+        """ Store an entry, replacing any existing one. """
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+        info['sha256'] = hashlib.sha256(body).hexdigest()
+
+        # Write each file under a temporary name first, so that a reader
+        # never sees half of an entry. The body goes first, and the hash
+        # check catches a body replaced between the two renames.
+        filename = self._filename(key)
+        suffix = '.%d.tmp' % threading.current_thread().ident
+        for ext, data in (('.body', body), ('.json', json.dumps(info))):
+            with open(filename + ext + suffix, 'wb') as file:
+                file.write(data)
+            if os.name == 'nt' and os.path.exists(filename + ext):
+                os.remove(filename + ext)
+            os.rename(filename + ext + suffix, filename + ext)
+
+    def clear(self):
+        """ Remove every stored response. """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+
+    def request(self, pool, method, url, headers=None, body=None):
+        """
+        Perform a request with the given :class:`ConnectionPool`, using and
+        updating the stored response. Returns the same as
+        :meth:`ConnectionPool.request`, except that a response reused after
+        ``304 Not Modified`` is returned with a status of 200.
+        """
+        key = self._key(method, url, body)
+        entry = self.load(key)
+        now = time.time()
+
+        headers = dict(headers or {})
+        if entry is not None:
+            info, cached = entry
+            if self.max_age and 0 <= now - info['fetched'] < self.max_age:
+                return 200, info['headers'], cached
+
+            if info['headers'].get('etag'):
+                headers['If-None-Match'] = info['headers']['etag']
+            if info['headers'].get('last-modified'):
+                headers['If-Modified-Since'] = \
+                    info['headers']['last-modified']
+
+        status, response_headers, data = pool.request(method, url, headers,
+                                                      body)
+
+        if status == 304 and entry is not None:
+            info['fetched'] = now
+            self.store(key, info, cached)
+            return 200, info['headers'], cached
+
+        if status == 200:
+            kept = dict((name, value) for name, value in
+                        response_headers.iteritems() if name in
+                        ('etag', 'last-modified', 'content-type'))
+            self.store(key, {'url': url, 'fetched': now, 'headers': kept},
+                       data)
+
+        return status, response_headers, data
+
+###############################################################################
+# Background Work
+###############################################################################
+
+class UpdaterRelay(QObject):
+    """
+    This object lives on the GUI thread and receives the results of
+    :class:`UpdaterTask` instances through queued connections, so that the
+    updater's signals are always emitted on the GUI thread.
+    """
+
+    finished = Signal(object, object, object)
+    failed = Signal(object, object)
+    progress = Signal(object, int, object)
+
+    def __init__(self, updater):
+        QObject.__init__(self)
+        self.updater = updater
+
+        self.finished.connect(self._on_finished, Qt.QueuedConnection)
+        self.failed.connect(self._on_failed, Qt.QueuedConnection)
+        self.progress.connect(self._on_progress, Qt.QueuedConnection)
+
+    def reporter(self, addon, message):
+        """
+        Return a function that worker threads can call with ``(done, total)``
+        to report progress on the add-on. Progress is only sent on when the
+        percentage changes.
+        """
+        last = [-1]
+        def report(done, total):
+            percent = min(99, done * 100 // total) if total else 0
+            if percent != last[0]:
+                last[0] = percent
+                self.progress.emit(addon, percent, message)
+        return report
+
+    @Slot(object, object, object)
+    def _on_finished(self, callback, addon, result):
+        try:
+            callback(addon, result)
+        except Exception, err:
+            log.exception('Error handling update.')
+            self._on_failed(addon, err)
+
+    @Slot(object, object)
+    def _on_failed(self, addon, err):
+        # Batch tasks work on a list of add-ons.
+        for addon in addon if isinstance(addon, list) else [addon]:
+            self.updater.update_error.emit(addon, err)
+
+    @Slot(object, int, object)
+    def _on_progress(self, addon, percent, message):
+        self.updater.update_progress[AddonInfo, int, str].emit(addon, percent,
+                                                                message)
+
+class UpdaterTask(QRunnable):
+    """
+    A :class:`PySide.QtCore.QRunnable` that runs a function for an add-on, or
+    a list of add-ons, on a worker thread, and hands the result to a callback
+    on the GUI thread.
+    """
+
+    def __init__(self, relay, addon, callback, function, *args):
+        QRunnable.__init__(self)
+        self.relay = relay
+        self.addon = addon
+        self.callback = callback
+        self.function = function
+        self.args = args
+
+    def run(self):
+        try:
+            result = self.function(*self.args)
+        except Exception, err:
+            log.debug('Update task failed: %s' % err)
+            self.relay.failed.emit(self.addon, err)
+        else:
+            self.relay.finished.emit(self.callback, self.addon, result)
+
+###############################################################################
+# HTTPUpdater Class
+###############################################################################
+
+class HTTPUpdater(IUpdater):
+    """
+    An updater that checks for updates with plain HTTP requests. Checks and
+    downloads for many add-ons run at once on worker threads, sharing a
+    bounded pool of keep-alive connections.
+
+    The information about each add-on is read from
+    ``{url}/{type}/{name}.json``, which should look like::
+
+        {"releases": [
+            {"version": "1.2.0",
+             "url": "foo-1.2.0.zip",
+             "sha256": "...",
+             "requires": {"__app__": ">= 2.0"}}
+        ]}
+
+    Download URLs are relative to the information file. Releases are zip
+    files of everything in the folder of the add-on's information file, and
+    are verified against ``sha256``, if it's provided. Downloads are
+    streamed to the cache, and resumed with ``Range`` requests if they're
+    interrupted.
+
+    :meth:`do_update` unpacks the new version into a :class:`StagedUpdate`
+    in the profile, and :func:`apply_updates` moves it into place when the
+    application next starts.
+
+    A release may also have a ``manifest`` URL, pointing to a list of every
+    file in that version along with its size and SHA-256 hash::
+
+        {"files": {"foo.plugin": {"size": 120, "sha256": "..."},
+                   "foo/__init__.py": {"size": 4096, "sha256": "..."}}}
+
+    Paths are relative to the folder of the add-on's information file, and
+    each file can be downloaded from its path relative to the manifest. When
+    there's a manifest, :meth:`do_update` hashes the installed copy of the
+    add-on, downloads only the files that have changed, and hard links or
+    copies the rest into the staged copy of the new version.
+    :func:`~siding.addons.catalog.build_manifest` makes manifests.
+
+    :meth:`check_updates` sends the types, names and versions of every add-on
+    in a single ``POST`` to ``{url}/catalog``, and expects the information
+    for all of them in return, as served by
+    :class:`~siding.addons.catalog.CatalogServer`. If the server doesn't
+    support that, each add-on is checked separately instead.
+
+    ================  ============
+    Argument          Description
+    ================  ============
+    manager           The Add-on Manager.
+    url               The base URL of the update server.
+    max_connections   *Optional.* The most requests to have running at once. Defaults to 8.
+    timeout           *Optional.* The socket timeout, in seconds. Defaults to 30.
+    max_age           *Optional.* How many seconds a stored update check stays fresh for, without asking the server. Defaults to 0.
+    cache             *Optional.* Set this to False to not store update checks on disk.
+    delta             *Optional.* Set this to False to always download complete releases.
+    ================  ============
+
+    Responses to update checks are stored in the cache directory, and are
+    revalidated with conditional requests. See :class:`ResponseCache`.
+    """
+
+    def __init__(self, manager, url, max_connections=8, timeout=30,
+                 max_age=0, cache=True, delta=True):
+        super(HTTPUpdater, self).__init__(manager)
+
+        self.url = url.rstrip('/') + '/'
+        self.delta = delta
+        self.pool = ConnectionPool(max_connections, timeout)
+
+        self.cache = None
+        if cache:
+            self.cache = ResponseCache(os.path.join(path.cache(), 'updates',
+                                                    'http'), max_age)
+
+        self.threads = QThreadPool()
+        self.threads.setMaxThreadCount(max_connections)
+
+        # The newest release found for each add-on, and staged updates.
+        self.available = {}
+        self.downloads = {}
+
+        self._relay = UpdaterRelay(self)
+
+    ##### Methods #############################################################
+
+    def addon_url(self, addon):
+        """ Return the URL of the update information for the add-on. """
+        return urlparse.urljoin(self.url, '%s/%s.json' % (addon._type_name,
+                                                          addon.name))
+
+    def can_update(self, addon):
+        """
+        Begin checking for a newer version of the provided add-on. If there is
+        one, ``update_available`` is emitted. Otherwise, ``update_finished``
+        is emitted with ``updated`` set to False.
+        """
+        self._start(addon, self._on_checked, self._fetch_releases,
+                    self.addon_url(addon))
+
+    def catalog_url(self):
+        """ Return the URL that catalog requests are sent to. """
+        return urlparse.urljoin(self.url, 'catalog')
+
+    def check_updates(self, addons):
+        """
+        Begin checking for updates to all the provided add-ons with a single
+        request. The same signals are emitted for each add-on as with
+        :meth:`can_update`.
+        """
+        addons = list(addons)
+        if not addons:
+            return
+
+        entries = [{'type': addon._type_name, 'name': addon.name,
+                    'version': str(addon.version)} for addon in addons]
+        self._start(addons, self._on_catalog, self._fetch_catalog,
+                    self.catalog_url(), entries)
+
+    def do_update(self, addon):
+        """
+        Begin downloading the newest version of the provided add-on, as found
+        by :meth:`can_update`. If no check has been made, one is made first.
+        Progress is reported with ``update_progress``, and the update is
+        installed the next time the application starts.
+        """
+        key = (addon._type_name, addon.name)
+        release = self.available.get(key)
+        if release is None:
+            self._start(addon, self._on_checked_for_update,
+                        self._fetch_releases, self.addon_url(addon))
+            return
+
+        # Updates are staged in the profile, relative to the folder of the
+        # add-on's information file. If that folder belongs to the add-on
+        # alone, it's replaced as a whole.
+        target = addon.path.path.replace('\\', '/').strip('/')
+        prefix = None
+        if posixpath.basename(target) == addon.name:
+            target, prefix = posixpath.split(target)
+
+        profile.ensure_paths()
+        staged = StagedUpdate(os.path.join(profile.profile_path,
+                                           STAGING_FOLDER, *key),
+                              target, prefix, release['version'])
+        downloads = os.path.join(path.cache(), 'updates')
+
+        message = 'Downloading version %s.' % release['version']
+        progress = self._relay.reporter(addon, message)
+        self.update_progress[AddonInfo, int, str].emit(addon, 0, message)
+
+        if self.delta and release.get('manifest') and \
+                not release.get('full'):
+            self._start(addon, self._on_staged, self._stage, addon.path,
+                        release['manifest'], staged, downloads, progress)
+        else:
+            filename = os.path.join(downloads, '%s-%s-%s.zip' % (
+                                    key + (release['version'], )))
+            self._start(addon, self._on_staged, self._install,
+                        release['url'], release.get('sha256'), filename,
+                        staged, progress)
+
+    def _start(self, addon, callback, function, *args):
+        """ Run the function on a worker thread. """
+        self.threads.start(UpdaterTask(self._relay, addon, callback, function,
+                                       *args))
+
+    ##### Worker Thread #######################################################
+
+    def _request(self, method, url, headers=None, body=None):
+        """ Perform a metadata request, through the cache if there is one. """
+        if self.cache is None:
+            return self.pool.request(method, url, headers, body)
+        return self.cache.request(self.pool, method, url, headers, body)
+
+    def _fetch_releases(self, url):
+        """ Fetch the list of releases from the given URL. """
+        status, headers, body = self._request(
+            'GET', url, {'Accept': 'application/json'})
+        if status == 404:
+            return []
+        elif status != 200:
+            raise IOError('Unexpected HTTP status %d from %s.' % (status, url))
+
+        releases = json.loads(body).get('releases', [])
+        for release in releases:
+            self._join_urls(url, release)
+        return releases
+
+    @staticmethod
+    def _join_urls(url, release):
+        """ Make the URLs of a release absolute. """
+        for key in ('url', 'manifest'):
+            if release.get(key):
+                release[key] = urlparse.urljoin(url, release[key])
+
+    def _fetch_catalog(self, url, entries):
+        """
+        Send a catalog request for the given entries, and return a dict of
+        releases by ``(type, name)``, or None if the server doesn't support
+        catalog requests.
+        """
+        status, headers, body = self._request(
+            'POST', url, {'Accept': 'application/json',
+                          'Content-Type': 'application/json'},
+            json.dumps({'addons': entries}))
+        if status in (404, 405, 501):
+            return None
+        elif status != 200:
+            raise IOError('Unexpected HTTP status %d from %s.' % (status, url))
+
+        out = {}
+        for type, addons in json.loads(body).get('addons', {}).iteritems():
+            for name, info in addons.iteritems():
+                releases = info.get('releases', [])
+                for release in releases:
+                    self._join_urls(url, release)
+                out[(type, name)] = releases
+        return out
+
+    def _download(self, url, sha256, filename, progress=None):
+        """
+        Download the file at the URL to the given filename, and verify it.
+        The file is written to ``{filename}.part`` as it arrives. If the
+        connection fails part way through, or the download was interrupted
+        before, it continues from where it stopped. That only happens when
+        there's a hash to verify the complete file with.
+        """
+        folder = os.path.dirname(filename)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        partial = PartialFile(filename + '.part', progress)
+        if not sha256:
+            partial.reset()
+
+        failures = 0
+        while True:
+            offset = partial.offset
+            try:
+                status, headers, body = self.pool.request(
+                    'GET', url, partial.headers(), output=partial)
+            except (httplib.HTTPException, socket.error), err:
+                if partial.offset > offset:
+                    failures = 0
+                failures += 1
+                if not sha256 or failures >= RETRIES:
+                    raise
+                log.debug('Resuming download of %s at %d bytes after: %s' %
+                          (url, partial.offset, err))
+                continue
+            finally:
+                partial.close()
+
+            if status == 416 and partial.offset:
+                # We already have more than the whole file.
+                partial.reset()
+                continue
+            break
+
+        if status not in (200, 206):
+            raise IOError('Unexpected HTTP status %d from %s.' % (status, url))
+
+        if sha256 and partial.digest.hexdigest() != sha256.lower():
+            partial.reset()
+            raise IOError('The download from %s is corrupt.' % url)
+
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(partial.filename, filename)
+        return filename
+
+    def _install(self, url, sha256, filename, staged, progress=None):
+        """
+        Download a complete release and unpack it into a
+        :class:`StagedUpdate`. Return the staged folder.
+        """
+        self._download(url, sha256, filename, progress)
+
+        files = staged.begin()
+        with zipfile.ZipFile(filename) as archive:
+            for name in archive.namelist():
+                if name.endswith('/'):
+                    continue
+                target = os.path.join(files, *_manifest_parts(name))
+                folder = os.path.dirname(target)
+                if not os.path.exists(folder):
+                    os.makedirs(folder)
+                with archive.open(name) as file:
+                    with open(target, 'wb') as out:
+                        shutil.copyfileobj(file, out, CHUNK_SIZE)
+
+        folder = staged.finish()
+        os.remove(filename)
+        return folder
+
+    def _stage(self, context, url, staged, downloads, progress=None):
+        """
+        Build a :class:`StagedUpdate` from the file manifest at the URL and
+        the installed files of the add-on, found with the
+        :class:`~siding.path.PathContext` ``context``. Changed files are
+        downloaded to the ``downloads`` folder first, named by their hash.
+        Return the staged folder, or None if there's no manifest.
+        """
+        status, headers, body = self._request(
+            'GET', url, {'Accept': 'application/json'})
+        if status == 404:
+            return None
+        elif status != 200:
+            raise IOError('Unexpected HTTP status %d from %s.' % (status, url))
+
+        files = json.loads(body).get('files', {})
+        folder = staged.begin()
+
+        # Reuse what we can, then download the rest.
+        needed = []
+        for name, entry in sorted(files.iteritems()):
+            target = os.path.join(folder, *_manifest_parts(name))
+            sha256 = entry['sha256'].lower()
+            if not self._reuse(context, name, entry.get('size'), sha256,
+                               target):
+                needed.append((name, entry.get('size') or 0, sha256, target))
+
+        total = sum(entry[1] for entry in needed)
+        done = [0]
+        def report(offset, size):
+            if progress:
+                progress(done[0] + offset, total)
+
+        for name, size, sha256, target in needed:
+            # A file left over from an interrupted update was verified when
+            # it was saved, so it needn't be downloaded again.
+            filename = os.path.join(downloads, 'files', sha256)
+            if not os.path.exists(filename):
+                self._download(urlparse.urljoin(url, urllib.quote(name)),
+                               sha256, filename, report)
+            if not os.path.exists(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            # The cache and the profile may be on different filesystems.
+            shutil.move(filename, target)
+            done[0] += size
+
+        log.debug('Staged %s with %d files downloaded and %d reused.' % (
+                  staged.folder, len(needed), len(files) - len(needed)))
+        return staged.finish()
+
+    def _reuse(self, context, name, size, sha256, target):
+        """
+        If the installed file at ``name`` matches the size and hash, link or
+        copy it to ``target`` and return True.
+        """
+        try:
+            # Files from pkg_resources can't be stat'd, so their hash has to
+            # be enough.
+            stat = context.stat(name)
+            if size is not None and stat is not None and stat.st_size != size:
+                return False
+            with context.open(name) as file:
+                if _hash_file(file) != sha256:
+                    return False
+        except (IOError, OSError):
+            return False
+
+        folder = os.path.dirname(target)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        try:
+            if stat is None:
+                # Don't have pkg_resources extract it just to link to it.
+                raise IOError
+            os.link(context.abspath(name), target)
+        except (AttributeError, IOError, OSError):
+            with context.open(name) as file:
+                with open(target, 'wb') as out:
+                    shutil.copyfileobj(file, out, CHUNK_SIZE)
+        return True
+
+    ##### GUI Thread ##########################################################
+
+    def _newest(self, addon, releases):
+        """
+        Return the newest release that's newer than the installed version of
+        the add-on and works with this application, or None.
+        """
+        best = None
+        app = None
+        for release in releases:
+            version = Version(release['version'])
+            if version <= addon.version or (best and
+                                            version <= best['version']):
+                continue
+
+            rule = release.get('requires', {}).get('__app__')
+            if rule:
+                if app is None:
+                    app = app_version()
+                if not VersionMatch(rule).test(app):
+                    continue
+
+            best = dict(release, version=version)
+
+        if best is not None:
+            best['version'] = str(best['version'])
+        return best
+
+    def _on_checked(self, addon, releases):
+        key = (addon._type_name, addon.name)
+        release = self._newest(addon, releases)
+        self.update_progress[AddonInfo, int].emit(addon, 100)
+
+        if release is None:
+            self.available.pop(key, None)
+            self.update_finished.emit(addon, False)
+        else:
+            self.available[key] = release
+            self.update_available.emit(addon, release['version'])
+
+    def _on_catalog(self, addons, catalog):
+        if catalog is None:
+            log.debug('Catalog requests not supported by %s.' % self.url)
+            for addon in addons:
+                self.can_update(addon)
+            return
+
+        for addon in addons:
+            self._on_checked(addon, catalog.get((addon._type_name,
+                                                 addon.name), []))
+
+    def _on_checked_for_update(self, addon, releases):
+        release = self._newest(addon, releases)
+        if release is None:
+            self.update_finished.emit(addon, False)
+        else:
+            self.available[(addon._type_name, addon.name)] = release
+            self.do_update(addon)
+
+    def _on_staged(self, addon, folder):
+        key = (addon._type_name, addon.name)
+        if folder is None:
+            # There's no manifest after all, so get the complete release.
+            self.available[key] = dict(self.available[key], full=True)
+            self.do_update(addon)
+            return
+
+        self.downloads[key] = folder
+        self.update_progress[AddonInfo, int].emit(addon, 100)
+        self.update_finished.emit(addon, True)
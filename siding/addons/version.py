@@ -24,8 +24,11 @@ are used internally by :doc:`addons` for testing add-on dependencies.
 # Imports
 ###############################################################################
 
+import operator
 import re
 
+from bisect import bisect_left, bisect_right
+
 ###############################################################################
 # Constants
 ###############################################################################
@@ -34,12 +37,57 @@ version_match = re.compile(r"(\d+)(?:\.(\d+)(?:\.(\d+))?)?(?:-([0-9A-Za-z-\.]+))
 rule_match = re.compile(r"(?:\s*([<>=!]+)\s*)([^\s<>=!]+)")
 name_match = re.compile(r"^\s*([^\s<>=!]+)")
 
+# Parsed version strings, so that the same string is only parsed once.
+_parsed = {}
+_PARSED_LIMIT = 4096
+
 def _value(val):
     try:
         return int(val)
     except ValueError:
         return val
 
+def _parse(version):
+    """
+    Parse a version string, returning a tuple of
+    ``(major, minor, patch, prerelease, build)``. Results are cached.
+    """
+    try:
+        return _parsed[version]
+    except KeyError:
+        pass
+
+    match = version_match.match(version)
+    if not match:
+        raise ValueError('%r is not a valid version string.' % version)
+
+    major, minor, patch, prerelease, build = match.groups()
+    parts = (int(major), int(minor) if minor else 0,
+             int(patch) if patch else 0,
+             tuple(map(_value, prerelease.split('.'))) if prerelease else None,
+             tuple(map(_value, build.split('.'))) if build else None)
+
+    if len(_parsed) >= _PARSED_LIMIT:
+        _parsed.clear()
+    _parsed[version] = parts
+    return parts
+
+def _sort_key(major, minor, patch, prerelease, build):
+    """
+    Return a tuple that sorts in the same order as the version. A version
+    with a prerelease comes before the same version without one.
+    """
+    return (major, minor, patch, (0, prerelease) if prerelease else (1, ),
+            build or ())
+
+def _key(version):
+    """ Return the sort key for a Version or a version string. """
+    if isinstance(version, Version):
+        return version._key
+    elif isinstance(version, basestring):
+        return _sort_key(*_parse(version))
+    raise TypeError('%r cannot be compared to a version.' % version)
+
 ###############################################################################
 # The Version Class
 ###############################################################################
@@ -66,45 +114,35 @@ class Version(object):
     strings should be formatted in a way compatible with
     `Semantic Versioning <http://semver.org/>`_.
     """
-    __slots__ = ('_major', '_minor', '_patch', '_prerelease', '_build')
+    __slots__ = ('_major', '_minor', '_patch', '_prerelease', '_build',
+                 '_key')
 
     def __init__(self, version=None):
-        self._major = self._minor = self._patch = 0
-        self._prerelease = self._build = None
-
         if version:
             if isinstance(version, Version):
-                self._major = version._major
-                self._minor = version._minor
-                self._patch = version._patch
-                self._prerelease = version._prerelease
-                self._build = version._build
+                self.__setstate__(version.__getstate__())
+                return
 
             elif isinstance(version, basestring):
-                match = version_match.match(version)
-                if match:
-                    self._major = int(match.group(1))
+                self.__setstate__(_parse(version))
+                return
 
-                    if match.group(2):
-                        self._minor = int(match.group(2))
+            else:
+                raise ValueError('%r cannot be converted to a version.' %
+                                version)
 
-                    if match.group(3):
-                        self._patch = int(match.group(3))
+        self.__setstate__((0, 0, 0, None, None))
 
-                    if match.group(4):
-                        self._prerelease = tuple(map(_value, match.group(4).
-                                                                split('.')))
+    ##### Pickling ############################################################
 
-                    if match.group(5):
-                        self._build = tuple(map(_value, match.group(5).
-                                                        split('.')))
-                else:
-                    raise ValueError('%r is not a valid version string.' %
-                                version)
+    def __getstate__(self):
+        return (self._major, self._minor, self._patch, self._prerelease,
+                self._build)
 
-            else:
-                raise ValueError('%r cannot be converted to a version.' %
-                                version)
+    def __setstate__(self, state):
+        (self._major, self._minor, self._patch, self._prerelease,
+            self._build) = state
+        self._key = _sort_key(*state)
 
     ##### Properties ##########################################################
 
@@ -137,6 +175,14 @@ class Version(object):
             return '.'.join(str(x) for x in self._build)
         return ''
 
+    @property
+    def sort_key(self):
+        """
+        A tuple that sorts in the same order as this version. It's useful
+        for sorting large lists of versions quickly.
+        """
+        return self._key
+
     ##### String Conversion ###################################################
 
     def __repr__(self):
@@ -157,90 +203,90 @@ class Version(object):
                 self._prerelease or self._build)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self._key)
 
     def __lt__(self, other):
-        if isinstance(other, basestring):
-            other = Version(other)
+        return self._key < _key(other)
 
-        if self._major < other._major:
-            return True
-        elif self._major > other._major:
-            return False
-
-        if self._minor < other._minor:
-            return True
-        elif self._minor > other._minor:
-            return False
-
-        if self._patch < other._patch:
-            return True
-        elif self._patch > other._patch:
-            return False
+    def __le__(self, other):
+        return self._key <= _key(other)
 
-        if self._prerelease and not other._prerelease:
-            return True
-        elif not self._prerelease and other._prerelease:
-            return False
-        elif self._prerelease < other._prerelease:
-            return True
-        elif self._prerelease > other._prerelease:
+    def __eq__(self, other):
+        try:
+            return self._key == _key(other)
+        except TypeError:
             return False
 
-        if self._build < other._build:
-            return True
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
-        return False
+    def __gt__(self, other):
+        return self._key > _key(other)
 
-    def __le__(self, other):
-        return not self.__gt__(other)
+    def __ge__(self, other):
+        return self._key >= _key(other)
 
-    def __eq__(self, other):
-        if isinstance(other, basestring):
-            other = Version(other)
+    ##### Bulk Operations #####################################################
 
-        return (self._major == other._major and self._minor == other._minor and
-            self._patch == other._patch and self._build == other._build and
-            self._prerelease == other._prerelease)
+    @staticmethod
+    def sort_many(versions, reverse=False):
+        """
+        Return a new list of :class:`Version` instances, sorted from oldest
+        to newest, from an iterable of versions and version strings.
+        """
+        out = [x if isinstance(x, Version) else Version(x) for x in versions]
+        out.sort(key=operator.attrgetter('_key'), reverse=reverse)
+        return out
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+###############################################################################
+# The VersionList Class
+###############################################################################
 
-    def __gt__(self, other):
-        if isinstance(other, basestring):
-            other = Version(other)
+class VersionList(object):
+    """
+    A sorted, unchanging list of versions that keeps the sort key of every
+    version, so that :meth:`VersionMatch.filter` and :meth:`VersionMatch.best`
+    can find matching versions with a binary search. Build one of these when
+    the same candidates will be checked against many rules, such as the
+    versions of an add-on in an update catalog.
+    """
+    __slots__ = ('versions', 'keys')
 
-        if self._major > other._major:
-            return True
-        elif self._major < other._major:
-            return False
+    def __init__(self, versions=()):
+        self.versions = Version.sort_many(versions)
+        self.keys = [x._key for x in self.versions]
 
-        if self._minor > other._minor:
-            return True
-        elif self._minor < other._minor:
-            return False
+    def __repr__(self):
+        return 'VersionList(%r)' % [str(x) for x in self.versions]
 
-        if self._patch > other._patch:
-            return True
-        elif self._patch < other._patch:
-            return False
+    def __len__(self):
+        return len(self.versions)
 
-        if other._prerelease and not self._prerelease:
-            return True
-        elif not other._prerelease and self._prerelease:
-            return False
-        elif self._prerelease > other._prerelease:
-            return True
-        elif self._prerelease < other._prerelease:
-            return False
+    def __iter__(self):
+        return iter(self.versions)
 
-        if self._build > other._build:
-            return True
+    def __getitem__(self, index):
+        return self.versions[index]
 
-        return False
+    def __contains__(self, version):
+        key = _key(version)
+        index = bisect_left(self.keys, key)
+        return index < len(self.keys) and self.keys[index] == key
 
-    def __ge__(self, other):
-        return not self.__lt__(other)
+    def slice(self, low=None, high=None):
+        """
+        Return the ``(start, stop)`` indices of the versions between the
+        given bounds. Each bound is either None or a tuple of
+        ``(key, inclusive)``.
+        """
+        start, stop = 0, len(self.keys)
+        if low is not None:
+            bisect = bisect_left if low[1] else bisect_right
+            start = bisect(self.keys, low[0])
+        if high is not None:
+            bisect = bisect_right if high[1] else bisect_left
+            stop = bisect(self.keys, high[0])
+        return start, max(start, stop)
 
 ###############################################################################
 # The VersionMatch Class
@@ -270,23 +316,56 @@ class VersionMatch(object):
     The rule list may be of any length, and consists of the repetition of an
     operator followed by a version string. Operators may be: ``<``, ``<=``,
     ``=``, ``!=``, ``>=``, ``>``
+
+    The rules are reduced to a single range with a lower and upper bound, and
+    a set of excluded versions, so testing a version costs the same no matter
+    how many rules there are.
     """
-    __slots__ = ('_comparisons', )
+    __slots__ = ('_comparisons', '_low', '_high', '_excluded')
 
     def __init__(self, rules):
-        self._comparisons = []
-
         if isinstance(rules, VersionMatch):
-            self._comparisons = rules._comparisons[:]
+            self.__setstate__(rules._comparisons[:])
 
         elif isinstance(rules, basestring):
-            for cmp, ver in rule_match.findall(rules):
-                ver = Version(ver)
-                self._comparisons.append((cmp, ver))
+            self.__setstate__([(cmp, Version(ver)) for cmp, ver in
+                               rule_match.findall(rules)])
 
         else:
             raise ValueError("%r cannot be converted to a VersionMatch.")
 
+    def __getstate__(self):
+        return self._comparisons
+
+    def __setstate__(self, state):
+        self._comparisons = state
+
+        # Reduce the rules to a range. Bounds are tuples of
+        # ``(key, inclusive, version)``. Unknown operators are ignored.
+        low = high = None
+        excluded = {}
+        for cmp, ver in state:
+            key = ver._key
+            if cmp == '!=':
+                excluded[key] = ver
+                continue
+
+            if cmp in ('>', '>=', '=', '=='):
+                bound = (key, cmp != '>', ver)
+                if low is None or key > low[0] or (key == low[0] and
+                                                   not bound[1]):
+                    low = bound
+
+            if cmp in ('<', '<=', '=', '=='):
+                bound = (key, cmp != '<', ver)
+                if high is None or key < high[0] or (key == high[0] and
+                                                     not bound[1]):
+                    high = bound
+
+        self._low = low
+        self._high = high
+        self._excluded = excluded
+
     def __repr__(self):
         return '<VersionMatch(%s)>' % str(self)
 
@@ -298,21 +377,108 @@ class VersionMatch(object):
         if not version:
             return False
 
-        for cmp, ver in self._comparisons:
-            if cmp == '=' or cmp == '==' and not version == ver:
-                return False
-            elif cmp == '<' and not version < ver:
-                return False
-            elif cmp == '<=' and not version <= ver:
-                return False
-            elif cmp == '>' and not version > ver:
-                return False
-            elif cmp == '>=' and not version >= ver:
-                return False
-            elif cmp == '!=' and not version != ver:
-                return False
+        return self._contains(_key(version))
+
+    def _contains(self, key):
+        """ Return True if the given sort key is within our range. """
+        if key in self._excluded:
+            return False
+        return self._in_range(key)
+
+    def _in_range(self, key):
+        """ Return True if the given sort key is between our bounds. """
+        low = self._low
+        if low is not None and (key < low[0] or
+                                (key == low[0] and not low[1])):
+            return False
+
+        high = self._high
+        if high is not None and (key > high[0] or
+                                 (key == high[0] and not high[1])):
+            return False
+
         return True
 
+    @property
+    def is_empty(self):
+        """ True if no version can possibly match these rules. """
+        low, high = self._low, self._high
+        if low is None or high is None:
+            return False
+        if low[0] != high[0]:
+            return low[0] > high[0]
+        return not (low[1] and high[1]) or low[0] in self._excluded
+
+    ##### Bulk Operations #####################################################
+
+    def _bounds(self):
+        low, high = self._low, self._high
+        return (low[:2] if low else None), (high[:2] if high else None)
+
+    def filter(self, versions):
+        """
+        Return a list of every version in ``versions`` that matches, sorted
+        from oldest to newest. ``versions`` may be a :class:`VersionList` or
+        any iterable of versions and version strings.
+        """
+        if not isinstance(versions, VersionList):
+            versions = VersionList(versions)
+
+        start, stop = versions.slice(*self._bounds())
+        excluded = self._excluded
+        return [x for x in versions.versions[start:stop]
+                if x._key not in excluded and x]
+
+    def best(self, versions):
+        """
+        Return the newest version in ``versions`` that matches, or None if
+        none of them do. ``versions`` may be a :class:`VersionList` or any
+        iterable of versions and version strings.
+        """
+        if not isinstance(versions, VersionList):
+            versions = VersionList(versions)
+
+        start, stop = versions.slice(*self._bounds())
+        excluded = self._excluded
+        for index in xrange(stop - 1, start - 1, -1):
+            version = versions.versions[index]
+            if version._key not in excluded and version:
+                return version
+
+    @classmethod
+    def intersect(cls, *matches):
+        """
+        Return a single VersionMatch that only matches the versions matched by
+        every one of the provided VersionMatch instances or rule strings. The
+        rules of the result are normalized to a lower bound, an upper bound,
+        and any excluded versions within them.
+        """
+        rules = []
+        for match in matches:
+            if not isinstance(match, VersionMatch):
+                match = VersionMatch(match)
+            rules.extend(match._comparisons)
+
+        combined = cls('')
+        combined.__setstate__(rules)
+        low, high = combined._low, combined._high
+
+        out = []
+        if low and high and low[0] == high[0] and low[1] and high[1]:
+            out.append(('=', low[2]))
+        else:
+            if low:
+                out.append(('>=' if low[1] else '>', low[2]))
+            if high:
+                out.append(('<=' if high[1] else '<', high[2]))
+
+        for key in sorted(combined._excluded):
+            if combined._in_range(key):
+                out.append(('!=', combined._excluded[key]))
+
+        combined.__setstate__(out)
+        return combined
+
     @staticmethod
     def from_string(rules):
         """
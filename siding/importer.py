@@ -0,0 +1,451 @@
+###############################################################################
+#
+# Copyright 2012 Siding Developers (see AUTHORS.txt)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+"""
+An importer for plugin modules that reads them through the plugin's
+:class:`~siding.path.PathContext`, so plugins are loaded the same way
+whether they're in a folder, or in a zipped egg or package used as a source
+with ``pkg_resources``. Nothing is extracted to disk.
+
+Each plugin's module is imported as ``siding_plugins.<plugin name>``, so two
+plugins can use the same module name, and no plugin can hide a module of the
+standard library. Plugins that are packages can import their own modules
+just as they always could.
+
+Compiled code is kept in a :class:`CodeCache` in :func:`siding.path.cache`,
+rather than next to the source, so plugins are only compiled again when
+their source changes, even when they're installed somewhere read only. To
+fill the cache when an application is installed, run::
+
+    python -m siding.importer path/to/app --plugin-path plugins
+"""
+
+###############################################################################
+# Imports
+###############################################################################
+
+import argparse
+import hashlib
+import imp
+import marshal
+import os
+import platform
+import re
+import shutil
+import sys
+import threading
+
+from siding import path
+
+###############################################################################
+# Logging
+###############################################################################
+
+import logging
+log = logging.getLogger('siding.importer')
+
+###############################################################################
+# Constants
+###############################################################################
+
+PACKAGE = 'siding_plugins'
+
+# Compiled code is kept separately for each interpreter and version.
+CACHE_TAG = '%s-%d%d' % ((platform.python_implementation().lower(), ) +
+                         sys.version_info[:2])
+
+###############################################################################
+# Helper Functions
+###############################################################################
+
+def module_name(info):
+    """ Return the full name the module of a plugin is imported as. """
+    return '%s.%s' % (PACKAGE, re.sub(r'\W', '_', info.name))
+
+###############################################################################
+# CodeCache Class
+###############################################################################
+
+class CodeCache(object):
+    """
+    A cache of compiled code in ``folder``. Each entry is keyed by the full
+    path of its source, and stored with a stamp of the source, such as its
+    modification time and size. Entries for other interpreters, or with a
+    different stamp, are ignored.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def filename(self, key):
+        """ Return the file the code for ``key`` is stored in. """
+        if isinstance(key, unicode):
+            key = key.encode('utf8')
+        return os.path.join(self.folder, CACHE_TAG,
+                            hashlib.sha1(key).hexdigest() + '.pyc')
+
+    def load(self, key, stamp):
+        """ Return the cached code, or None if it's missing or stale. """
+        try:
+            with open(self.filename(key), 'rb') as file:
+                if file.read(4) != imp.get_magic():
+                    return None
+                if marshal.load(file) != (key, stamp):
+                    return None
+                return marshal.load(file)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, key, stamp, code):
+        """ Store compiled code, ignoring any errors doing so. """
+        filename = self.filename(key)
+        temp = '%s.%d.tmp' % (filename, threading.current_thread().ident)
+        try:
+            folder = os.path.dirname(filename)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(temp, 'wb') as file:
+                file.write(imp.get_magic())
+                marshal.dump((key, stamp), file)
+                marshal.dump(code, file)
+            if os.name == 'nt' and os.path.exists(filename):
+                os.remove(filename)
+            os.rename(temp, filename)
+        except (IOError, OSError), err:
+            log.debug('Unable to cache compiled code for %r: %s' % (key, err))
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    def clear(self):
+        """ Remove all the cached code for this interpreter. """
+        folder = os.path.join(self.folder, CACHE_TAG)
+        if os.path.exists(folder):
+            shutil.rmtree(folder, True)
+
+###############################################################################
+# PluginImporter Class
+###############################################################################
+
+class PluginImporter(object):
+    """
+    A :pep:`302` finder and loader for the modules of plugins. Plugins must
+    be registered with :meth:`register` before they can be imported.
+
+    If ``cache`` is set, it's the :class:`CodeCache` compiled code is stored
+    in. By default, that's the folder ``plugins`` in :func:`siding.path.cache`.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._plugins = {}
+        self._locks = {}
+        self._lock = threading.RLock()
+
+    ##### Registration ########################################################
+
+    def install(self):
+        """ Add the importer to :data:`sys.meta_path`, if it isn't there. """
+        if self not in sys.meta_path:
+            sys.meta_path.append(self)
+        return self
+
+    def register(self, info):
+        """
+        Make the module of the given :class:`~siding.plugins.PluginInfo`
+        importable, and return the name to import it with. Any modules left
+        from an earlier version of the plugin are forgotten.
+        """
+        if self.cache is None:
+            self.cache = CodeCache(os.path.join(path.cache(), 'plugins'))
+
+        fullname = module_name(info)
+        key = fullname[len(PACKAGE) + 1:]
+        with self._lock:
+            old = self._plugins.get(key)
+            if old is not None and old is not info:
+                self.forget(fullname)
+            self._plugins[key] = info
+        return fullname
+
+    def forget(self, fullname):
+        """ Remove a plugin's module, and its submodules, from sys.modules. """
+        for name in sys.modules.keys():
+            if name == fullname or name.startswith(fullname + '.'):
+                del sys.modules[name]
+
+    def load(self, info):
+        """
+        Register the plugin, import its module, and return it.
+
+        Python's global import lock isn't held while the module runs, just a
+        lock for the module itself, so the modules of different plugins can
+        be loaded on different threads at once. Any imports they make still
+        take the global lock.
+        """
+        fullname = self.register(info)
+        if PACKAGE not in sys.modules:
+            __import__(PACKAGE)
+
+        with self._module_lock(fullname):
+            module = sys.modules.get(fullname)
+            if module is None:
+                module = self.load_module(fullname)
+                setattr(sys.modules[PACKAGE], fullname[len(PACKAGE) + 1:],
+                        module)
+            return module
+
+    def _module_lock(self, fullname):
+        """ Return the lock for loading the given module. """
+        with self._lock:
+            lock = self._locks.get(fullname)
+            if lock is None:
+                lock = self._locks[fullname] = threading.RLock()
+            return lock
+
+    def precompile(self, info):
+        """
+        Compile every module of the plugin into the cache without running
+        any of them, and return how many there were. Modules with syntax
+        errors are logged and skipped.
+        """
+        count = 0
+        for fullname in self._modules(info):
+            try:
+                self.get_code(fullname)
+            except (SyntaxError, ImportError, IOError), err:
+                log.error('Unable to compile %s: %s' % (fullname, err))
+                continue
+            count += 1
+        return count
+
+    def _modules(self, info):
+        """ Return the full names of every module of the plugin. """
+        fullname = self.register(info)
+        location = self._locate(fullname)
+        if location is None:
+            return []
+
+        names = [fullname]
+        if location[2]:
+            root = info.module or info.name
+            base = path.join(info.path.path, root)
+            for top, dirs, files in info.path.walk(root):
+                prefix = [fullname] + [part for part in
+                                       top[len(base):].split('/') if part]
+                for name in files:
+                    if name == '__init__.py':
+                        if len(prefix) > 1:
+                            names.append('.'.join(prefix))
+                    elif re.match(r'^\w+\.py$', name):
+                        names.append('.'.join(prefix + [name[:-3]]))
+        return names
+
+    ##### Finding #############################################################
+
+    def _locate(self, fullname):
+        """
+        Return a tuple of ``(info, filename, is_package)`` for the module, or
+        None if it isn't a plugin module. The filename is relative to the
+        plugin's path.
+        """
+        parts = fullname.split('.')
+        if parts[0] != PACKAGE or len(parts) < 2:
+            return None
+
+        info = self._plugins.get(parts[1])
+        if info is None:
+            return None
+
+        name = '/'.join([info.module or info.name] + parts[2:])
+        if info.path.isfile(name + '/__init__.py'):
+            return info, name + '/__init__.py', True
+        elif info.path.isfile(name + '.py'):
+            return info, name + '.py', False
+        return None
+
+    def find_module(self, fullname, path=None):
+        if fullname == PACKAGE or self._locate(fullname) is not None:
+            return self
+        return None
+
+    ##### Loading #############################################################
+
+    def load_module(self, fullname):
+        module = sys.modules.get(fullname)
+        if module is not None:
+            return module
+
+        if fullname == PACKAGE:
+            # The namespace all plugins live in.
+            module = imp.new_module(fullname)
+            module.__path__ = []
+            module.__loader__ = self
+            module.__package__ = fullname
+            sys.modules[fullname] = module
+            return module
+
+        location = self._locate(fullname)
+        if location is None:
+            raise ImportError('No module named %s' % fullname)
+        info, filename, is_package = location
+
+        code = self.get_code(fullname)
+
+        module = imp.new_module(fullname)
+        module.__file__ = self._filename(info, filename)
+        module.__loader__ = self
+        if is_package:
+            module.__path__ = [os.path.dirname(module.__file__)]
+            module.__package__ = fullname
+        else:
+            # A plugin that's a single module is treated as top level, so its
+            # imports can't find other plugins instead of what they meant.
+            parent = fullname.rpartition('.')[0]
+            module.__package__ = '' if parent == PACKAGE else parent
+
+        sys.modules[fullname] = module
+        try:
+            exec code in module.__dict__
+        except BaseException:
+            sys.modules.pop(fullname, None)
+            raise
+
+        return sys.modules[fullname]
+
+    def _filename(self, info, filename):
+        """ Return a filename for the module, for tracebacks. """
+        source = info.path_source
+        if isinstance(source, basestring) and not source.startswith('py:'):
+            return os.path.join(source, info.path.path, filename)
+        return '%s/%s/%s' % (source, info.path.path, filename)
+
+    def is_package(self, fullname):
+        if fullname == PACKAGE:
+            return True
+        location = self._locate(fullname)
+        if location is None:
+            raise ImportError('No module named %s' % fullname)
+        return location[2]
+
+    def get_source(self, fullname):
+        if fullname == PACKAGE:
+            return None
+        location = self._locate(fullname)
+        if location is None:
+            raise ImportError('No module named %s' % fullname)
+        info, filename, is_package = location
+        with info.path.open(filename) as file:
+            return file.read()
+
+    ##### Compiled Code #######################################################
+
+    def get_code(self, fullname):
+        if fullname == PACKAGE:
+            return compile('', PACKAGE, 'exec')
+
+        location = self._locate(fullname)
+        if location is None:
+            raise ImportError('No module named %s' % fullname)
+        info, filename, is_package = location
+
+        # Use the modification time and size to check the cache, if the
+        # source has them. Otherwise, use a hash of the source.
+        source = None
+        stat = info.path.stat(filename)
+        if stat is not None:
+            stamp = (int(stat.st_mtime), stat.st_size)
+        else:
+            source = self.get_source(fullname)
+            stamp = hashlib.sha1(source).hexdigest()
+
+        key = self._filename(info, filename)
+        code = self.cache.load(key, stamp)
+        if code is not None:
+            return code
+
+        if source is None:
+            source = self.get_source(fullname)
+        code = compile(source.replace('\r\n', '\n') + '\n', key, 'exec')
+        self.cache.store(key, stamp, code)
+        return code
+
+###############################################################################
+# The Importer
+###############################################################################
+
+importer = PluginImporter().install()
+
+###############################################################################
+# Command Line Interface
+###############################################################################
+
+def main(args=None):
+    """ Precompile plugins with the given command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog='python -m siding.importer',
+        description='Compile the plugins of an application into the cache.')
+    parser.add_argument('sources', nargs='+', metavar='source',
+        help='A directory or package to search for plugins.')
+    parser.add_argument('-p', '--plugin-path', action='append',
+        dest='paths', help='A path within the sources to search for plugins. '
+                           'This may be used more than once. Defaults to '
+                           'plugins.')
+    parser.add_argument('-c', '--cache',
+        help='The folder to store compiled code in. Defaults to the plugins '
+             'folder of the application\'s cache.')
+    parser.add_argument('--clear', action='store_true',
+        help='Remove everything from the cache before compiling.')
+
+    options = parser.parse_args(args)
+
+    # Use the importer plugins are really loaded with, even when we're being
+    # run as __main__.
+    from siding import addons, plugins
+    from siding.importer import importer, CodeCache
+
+    if options.cache:
+        importer.cache = CodeCache(os.path.abspath(options.cache))
+    elif importer.cache is None:
+        importer.cache = CodeCache(os.path.join(path.cache(), 'plugins'))
+
+    if options.clear:
+        importer.cache.clear()
+
+    for source in options.sources:
+        if not os.path.isdir(source):
+            if source.startswith('py:'):
+                source = source[3:]
+            __import__(source)
+            source = sys.modules[source]
+        path.add_source(source)
+
+    plugins.initialize(paths=options.paths or ['plugins'], load=False,
+                       activate=False)
+
+    modules = count = 0
+    for info in addons.find('plugin'):
+        modules += importer.precompile(info)
+        count += 1
+
+    print 'Compiled %d modules of %d plugins into %s' % (
+        modules, count, importer.cache.folder)
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    sys.exit(main())
@@ -37,6 +37,7 @@ import errno
 import imp
 import os
 import sys
+import threading
 import types
 
 try:
@@ -56,7 +57,10 @@ from PySide.QtGui import QDesktopServices
 # Settings
 ###############################################################################
 
+# The source list is never changed in place. It's replaced, while holding
+# _lock, so it can be safely iterated from any thread.
 _sources = []
+_lock = threading.Lock()
 
 ###############################################################################
 # Internal Helpers
@@ -103,60 +107,69 @@ def add_source(source, add_to_start=False):
         If the profile system is in use, the profile specific path will
         *always* be at the beginning of the source list, regardless of the use
         of ``add_to_start``. If you absolutely must add a source to be checked
-        before the profile path, modify ``siding.path._sources`` directly.
+        before the profile path, replace ``siding.path._sources`` directly.
         Additionally, the root path, if set, will *always* be at the end of
         source list unless you modify the source list directly.
     """
+    global _sources
     from siding import profile
 
-    if profile.profile_path:
-        if not profile.profile_path in _sources:
-            _sources.insert(0, profile.profile_path)
-        start_ind = _sources.index(profile.profile_path) + 1
-    else:
-        start_ind = 0
+    with _lock:
+        # Work on a copy, so anything iterating the list isn't disturbed.
+        sources = _sources[:]
 
-    if profile.root_path:
-        if not profile.root_path in _sources:
-            _sources.append(profile.root_path)
-        end_ind = _sources.index(profile.root_path)
-    else:
-        end_ind = len(_sources)
-
-    # If the source is already there, just return.
-    if source in _sources:
-        return
+        if profile.profile_path:
+            if not profile.profile_path in sources:
+                sources.insert(0, profile.profile_path)
+            start_ind = sources.index(profile.profile_path) + 1
+        else:
+            start_ind = 0
 
-    if isinstance(source, basestring) and not source.startswith('py:'):
-        if os.path.exists(source):
-            source = os.path.abspath(source)
+        if profile.root_path:
+            if not profile.root_path in sources:
+                sources.append(profile.root_path)
+            end_ind = sources.index(profile.root_path)
         else:
-            file = None
-            try:
-                file, path, desc = imp.find_module(source)
+            end_ind = len(sources)
 
-                assert_pkg_resources()
-                source = 'py:%s' % source
+        # If the source is already there, just return.
+        if source in sources:
+            _sources = sources
+            return
 
-            except ImportError:
-                raise IOError(errno.ENOENT,
-                    'No such file or directory or package: %r' % source)
-            finally:
-                if file:
-                    file.close()
+        if isinstance(source, basestring) and not source.startswith('py:'):
+            if os.path.exists(source):
+                source = os.path.abspath(source)
+            else:
+                file = None
+                try:
+                    file, path, desc = imp.find_module(source)
 
-    elif isinstance(source, types.ModuleType):
-        assert_pkg_resources()
-        source = 'py:%s' % source.__name__
+                    assert_pkg_resources()
+                    source = 'py:%s' % source
 
-    elif not isinstance(source, _Requirement):
-        assert_pkg_resources()
-        raise TypeError('source must be a string or pkg_resources.Requirement')
+                except ImportError:
+                    raise IOError(errno.ENOENT,
+                        'No such file or directory or package: %r' % source)
+                finally:
+                    if file:
+                        file.close()
 
-    if add_to_start:
-        _sources.insert(start_ind, source)
-    else:
-        _sources.insert(end_ind, source)
+        elif isinstance(source, types.ModuleType):
+            assert_pkg_resources()
+            source = 'py:%s' % source.__name__
+
+        elif not isinstance(source, _Requirement):
+            assert_pkg_resources()
+            raise TypeError('source must be a string or '
+                            'pkg_resources.Requirement')
+
+        if add_to_start:
+            sources.insert(start_ind, source)
+        else:
+            sources.insert(end_ind, source)
+
+        _sources = sources
 
 ###############################################################################
 # Special Paths
@@ -393,6 +406,42 @@ def abspath(name, creating=False, source=None):
     # Still here? Guess we didn't find it.
     raise IOError(errno.ENOENT, 'No such file or directory: %r' % name)
 
+def stat(name, source=None):
+    """
+    Find the given path and return the result of :func:`os.stat` for it. Files
+    provided by ``pkg_resources`` can't be stat'd, so None is returned for
+    them.
+
+    If the path cannot be found, raise an IOError.
+    """
+    if os.path.isabs(name):
+        return os.stat(name)
+
+    # Iterate through our sources until we can find it.
+    if isinstance(source, (tuple, list)):
+        sources = list(source)
+    else:
+        sources = [source] if source else _sources
+
+    for src in sources:
+        # Are we dealing with a directory name?
+        if isinstance(src, basestring) and not src.startswith('py:'):
+            try:
+                return os.stat(os.path.join(src, name))
+            except OSError:
+                continue
+
+        # Must be a ``pkg_resources`` thing.
+        assert_pkg_resources()
+        if isinstance(src, basestring):
+            src = src[3:]
+
+        if pkg_resources.resource_exists(src, name):
+            return None
+
+    # Still here? Guess we didn't find it.
+    raise IOError(errno.ENOENT, 'No such file or directory: %r' % name)
+
 ###############################################################################
 # Path Enumeration Functions
 ###############################################################################
@@ -424,7 +473,9 @@ def listdir(name, source=None):
                 continue
             this_src = pkg_resources.resource_listdir(src, name)
         for entry in this_src:
-            yield entry
+            # Zipped sources list an empty name for each directory entry.
+            if entry:
+                yield entry
 
 def exists(name, source=None):
     """  Returns True if the path exists, False otherwise. """
@@ -528,6 +579,10 @@ def walk(top, topdown=True, onerror=None, followlinks=False, source=None):
 
     .. seealso:: :func:`os.walk`
     """
+    # A single source has to be a list, so it can be filtered below.
+    if source and not isinstance(source, (tuple, list)):
+        source = [source]
+
     try:
         names = listdir(top, source)
     except OSError, err:
@@ -576,7 +631,11 @@ class PathContext(object):
 
     Every path manipulation function available in ``siding.path`` is available
     with a PathContext.
+
+    If ``source`` is a list, it's shared rather than copied. It's only copied
+    if :meth:`add_source` is used.
     """
+    __slots__ = ('path', '_source')
 
     def __init__(self, path, source):
         super(PathContext, self).__init__()
@@ -661,6 +720,11 @@ class PathContext(object):
             return name
         return abspath(join(self.path, name), creating, source=self._source)
 
+    def stat(self, name):
+        if os.path.isabs(name):
+            return os.stat(name)
+        return stat(join(self.path, name), source=self._source)
+
     def listdir(self, name):
         if not os.path.isabs(name):
             name = join(self.path, name)
@@ -25,13 +25,19 @@ TODO: Write this docstring.
 
 import argparse
 import functools
+import imp
 import inspect
+import Queue
+import re
 import sys
 
-from PySide.QtCore import QObject, Signal
-import imp
+from timeit import default_timer as clock
+
+from PySide.QtCore import QObject, QRunnable, QThreadPool, Signal
 
 from siding import addons
+from siding.addons.base import INFO_FULL
+from siding.importer import importer
 
 ###############################################################################
 # Logging
@@ -48,6 +54,35 @@ def issignal(signal):
     """ Return True if signal is an instance of QtCore.Signal. """
     return isinstance(signal, Signal)
 
+def _names(value):
+    """ Parse a list of names separated by commas or whitespace. """
+    return frozenset(name for name in re.split(r'[\s,]+', value) if name)
+
+def plugin_interface(cls):
+    """
+    Return a tuple of ``(slots, signals)`` with the names of the slots and
+    signals of the given plugin class. The class is only examined once, and
+    the result is stored on it.
+    """
+    interface = cls.__dict__.get('_plugin_interface')
+    if interface is not None:
+        return interface
+
+    slots = set()
+    signals = set()
+    for name in dir(cls):
+        if name.startswith('__'):
+            continue
+        value = getattr(cls, name, None)
+        if isinstance(value, Signal):
+            signals.add(name)
+        elif hasattr(value, '_slots'):
+            slots.add(name)
+
+    interface = (frozenset(slots), frozenset(signals))
+    setattr(cls, '_plugin_interface', interface)
+    return interface
+
 ###############################################################################
 # Plugin Interface
 ###############################################################################
@@ -125,6 +160,12 @@ class IPlugin(QObject):
         if val == self._is_active:
             return
 
+        with addons.tracing.span('activate' if val else 'deactivate',
+                                 self._info.name, 'plugin'):
+            self._set_active(val)
+
+    def _set_active(self, val):
+        """ Perform the actual work of activating or deactivating. """
         # Don't set _is_active just yet.
         if val:
             # Check our dependencies first.
@@ -170,7 +211,7 @@ class IPlugin(QObject):
 
             # Make sure we're needed.
             if not self._name in dep.needed_by:
-                dep.needed_by.append(self._name)
+                dep.needed_by += (self._name,)
 
             # If it's active, just continue.
             if dep.is_active:
@@ -193,39 +234,11 @@ class IPlugin(QObject):
 
     def _connect_signals(self):
         """ Connect to all the available slots and signals. """
-        for signame in self._manager._signals:
-            slot = getattr(self, signame, None)
-            if not slot or not hasattr(slot, '_slots'):
-                continue
-
-            for signal in self._manager._signals[signame]:
-                signal.connect(slot)
-
-        for signame in self._manager._slots:
-            signal = getattr(self, signame, None)
-            if not signal or not isinstance(signal, Signal):
-                continue
-
-            for slot in self._manager._slots[signame]:
-                signal.connect(slot)
+        self._manager._attach(self)
 
     def _disconnect_signals(self):
         """ Disconnect all of our signals and slots. """
-        for signame in self._manager._signals:
-            slot = getattr(self, signame, None)
-            if not slot or not hasattr(slot, '_slots'):
-                continue
-
-            for signal in self._manager._signals[signame]:
-                signal.disconnect(slot)
-
-        for signame in self._manager._slots:
-            signal = getattr(self, signame, None)
-            if not signal or not isinstance(signal, Signal):
-                continue
-
-            for slot in self._manager._slots[signame]:
-                signal.disconnect(slot)
+        self._manager._detach(self)
 
     ##### Public Methods ######################################################
 
@@ -254,10 +267,11 @@ class PluginInfo(addons.AddonInfo):
     user.
     """
 
-    CORE_VALUES = ('module',)
+    CORE_VALUES = ('module', ('slots', _names))
 
     # Defaults
     module = None
+    slots = frozenset()
     _plugin = None
 
     ##### Properties ##########################################################
@@ -280,6 +294,14 @@ class PluginInfo(addons.AddonInfo):
         """ Whether or not the plugin is currently active. """
         return getattr(self._plugin, 'is_active', False)
 
+    @property
+    def is_dormant(self):
+        """
+        Whether or not the plugin is waiting for one of its declared slots to
+        be called before it's loaded.
+        """
+        return self.name in manager._dormant
+
     ##### Actions #############################################################
 
     @addons.action('&Options', default=True)
@@ -306,6 +328,22 @@ class PluginInfo(addons.AddonInfo):
             self.enable.text = '&Enable'
             return False
 
+    ##### Removal #############################################################
+
+    def on_remove(self):
+        """
+        Deactivate the plugin before it's removed from the Add-on Manager, and
+        make sure no other plugins think they're needed by it.
+        """
+        if self.is_active:
+            self._plugin.deactivate()
+        elif self.is_dormant:
+            manager._remove_dormant(self)
+
+        for dep in addons.find('plugin', lambda info:
+                                            self.name in info.needed_by):
+            dep.needed_by = tuple(x for x in dep.needed_by if x != self.name)
+
     ##### Plugin Loading ######################################################
 
     def load(self, ignore_blacklist=False):
@@ -315,6 +353,25 @@ class PluginInfo(addons.AddonInfo):
                         self.data['name'])
             return
 
+        # Load our dependencies.
+        for dep in self._check_load(ignore_blacklist):
+            # If it's loaded, just continue.
+            if dep.is_loaded:
+                continue
+            dep.load()
+
+        # Okay, now load!
+        self._do_load()
+
+    def _check_load(self, ignore_blacklist=False):
+        """
+        Make sure we can be loaded, and return a list of the plugins we
+        require. Raise :class:`~siding.addons.DependencyError` if we can't.
+        """
+        # Read all of our information now, so nothing reads it for the first
+        # time while our module is imported on another thread.
+        self._ensure_information(INFO_FULL)
+
         if not ignore_blacklist and self.is_blacklisted:
             raise addons.DependencyError('Plugin %r is blacklisted.' % 
                                          self.data['name'])
@@ -322,7 +379,7 @@ class PluginInfo(addons.AddonInfo):
         # Check our dependencies for safety.
         addons.check_dependencies(self)
 
-        # Load our dependencies.
+        deps = []
         for name in self.requires.iterkeys():
             if name == '__app__' or (':' in name and not
                     name.startswith('plugin:')):
@@ -331,52 +388,50 @@ class PluginInfo(addons.AddonInfo):
 
             # Make sure we're needed.
             if not self.name in dep.needed_by:
-                dep.needed_by.append(self.name)
-
-            # If it's loaded, just continue.
-            if dep.is_loaded:
-                continue
-            dep.load()
+                dep.needed_by += (self.name,)
+            deps.append(dep)
 
-        # Okay, now load!
-        self._do_load()
+        return deps
 
     def _do_load(self):
         """ Find our module and load it. """
+        self._finish_load(self._load_module())
+
+    def _load_module(self):
+        """
+        Import our module and return it. This is safe to call from a worker
+        thread, as it doesn't touch the plugin system.
+        """
         # Figure out what to load.
         modname = self.module if self.module else self.name
 
-        # Depending on whether our source is using ``pkg_resources`` or not,
-        # fork here.
-        if (isinstance(self.path_source, basestring) and not
-                self.path_source.startswith('py:')):
-            # It's a filesystem. Just do things the easy way.
-            path = self.path.abspath('.')
-            file = None
-            try:
-                file, pathname, description = imp.find_module(modname, [path])
-                module = imp.load_module(modname, file, pathname, description)
-            finally:
-                if file:
-                    file.close()
-
-        else:
-            # TODO: Fancy, pkg_resource importer code here.
-            # Until then, a copy paste of the previous!
-            path = self.path.abspath('.')
-            file = None
-            try:
-                file, pathname, description = imp.find_module(modname, [path])
-                module = imp.load_module(modname, file, pathname, description)
-            finally:
-                if file:
-                    file.close()
+        # Import it through the plugin importer, wherever it's from.
+        with addons.tracing.span('import', self.name, 'plugin'):
+            return self._import_module(modname)
 
+    def _finish_load(self, module):
+        """ Create our plugin from our module. """
         # We've got a module! Now, what to do with it? Store its plugin, of
         # course! Find the first IPlugin subclass and instance it.
+        with addons.tracing.span('instantiate', self.name, 'plugin'):
+            self._instance_plugin(module)
+
+        # Log how happy we are.
+        log.info('Loaded plugin %r.' % self.data['name'])
+
+    def _import_module(self, modname):
+        """
+        Import our module through the plugin importer, which reads it from
+        whatever source we were found in, and return it.
+        """
+        return importer.load(self)
+
+    def _instance_plugin(self, module):
+        """ Find the first IPlugin subclass in module and instance it. """
         for key in dir(module):
             val = getattr(module, key)
-            if inspect.isclass(val) and issubclass(val, IPlugin):
+            if inspect.isclass(val) and issubclass(val, IPlugin) and \
+                    val is not IPlugin:
                 try:
                     self._plugin = val(manager, self)
                     break
@@ -389,9 +444,6 @@ class PluginInfo(addons.AddonInfo):
                           self.data['name'])
             raise ImportError
 
-        # Log how happy we are.
-        log.info('Loaded plugin %r.' % self.data['name'])
-
 # Registration
 addons.add_type(
     'plugin',
@@ -409,6 +461,21 @@ class PluginManager(object):
     """
     This class handles the loading of plugins, as well as the connection of
     signals and slots between the plugins and the rest of the application.
+
+    The slots and signals of each active plugin are kept in routing tables by
+    name, so :meth:`run_signal` and the other methods only touch the plugins
+    that actually have a matching slot or signal.
+
+    Plugins can declare their slots in the Core section of their information
+    file::
+
+        [Core]
+        version = 1.0
+        slots = opened_addon_manager, file_saved
+
+    A plugin with declared slots isn't loaded by :func:`initialize`. Instead,
+    the plugin is left dormant, with a stand-in for each declared slot, and
+    it's loaded and activated the first time one of those slots is called.
     """
 
     def __init__(self):
@@ -416,6 +483,134 @@ class PluginManager(object):
         self._signals = {}
         self._slots = {}
 
+        # The routing tables. For each name, a tuple of (plugin, slot) for the
+        # matching slots of active plugins, and a tuple of (plugin, signal)
+        # for their matching signals. The tuples are replaced rather than
+        # changed, so they can be iterated over while plugins change state.
+        self._routes = {}
+        self._emitters = {}
+
+        # Plugins waiting for a declared slot to be called, by name.
+        self._dormant = {}
+
+    ##### Routing Tables ######################################################
+
+    def _attach(self, plugin):
+        """
+        Add a newly active plugin to the routing tables, and connect it to
+        the registered signals and slots.
+        """
+        slots, signals = plugin_interface(type(plugin))
+
+        # A dormant plugin can be loaded some other way, such as being
+        # needed by another plugin.
+        if plugin.name in self._dormant:
+            self._remove_dormant(plugin.info)
+
+        missing = plugin.info.slots.difference(slots)
+        if missing:
+            log.warning('Plugin %r declares slots it lacks: %s' % (
+                        plugin.name, ', '.join(sorted(missing))))
+
+        for name in slots:
+            slot = getattr(plugin, name)
+            self._routes[name] = self._routes.get(name, ()) + ((plugin, slot),)
+            for signal in self._signals.get(name, ()):
+                signal.connect(slot)
+
+        for name in signals:
+            signal = getattr(plugin, name)
+            self._emitters[name] = self._emitters.get(name, ()) + \
+                                   ((plugin, signal),)
+            for slot in self._slots.get(name, ()):
+                signal.connect(slot)
+
+    def _detach(self, plugin):
+        """
+        Remove a plugin from the routing tables, and disconnect it from the
+        registered signals and slots.
+        """
+        slots, signals = plugin_interface(type(plugin))
+
+        for name in slots:
+            routes = self._routes.get(name, ())
+            for owner, slot in routes:
+                if owner is plugin:
+                    for signal in self._signals.get(name, ()):
+                        signal.disconnect(slot)
+            self._set_route(self._routes, name, routes, plugin)
+
+        for name in signals:
+            emitters = self._emitters.get(name, ())
+            for owner, signal in emitters:
+                if owner is plugin:
+                    for slot in self._slots.get(name, ()):
+                        signal.disconnect(slot)
+            self._set_route(self._emitters, name, emitters, plugin)
+
+    def _add_dormant(self, info):
+        """
+        Register stand-ins for the declared slots of a plugin that hasn't
+        been loaded, so that it's loaded when one of them is first called.
+        """
+        if info.name in self._dormant or info.is_loaded:
+            return
+        self._dormant[info.name] = info
+
+        for name in info.slots:
+            proxy = functools.partial(self._wake, info, name)
+            self._routes[name] = self._routes.get(name, ()) + ((info, proxy),)
+            for signal in self._signals.get(name, ()):
+                signal.connect(proxy)
+
+    def _remove_dormant(self, info):
+        """ Remove the stand-ins of a dormant plugin. """
+        if self._dormant.pop(info.name, None) is None:
+            return
+
+        for name in info.slots:
+            routes = self._routes.get(name, ())
+            for owner, proxy in routes:
+                if owner is info:
+                    for signal in self._signals.get(name, ()):
+                        signal.disconnect(proxy)
+            self._set_route(self._routes, name, routes, info)
+
+    def _wake(self, info, name, *args):
+        """
+        Load and activate a dormant plugin, and pass the call that woke it on
+        to its slot.
+        """
+        if info.name in self._dormant:
+            self._remove_dormant(info)
+            log.debug('Waking plugin %r for %r.' % (info.name, name))
+            try:
+                if not info.is_loaded:
+                    info.load()
+                if not info.is_active:
+                    info.plugin.activate()
+            except (addons.DependencyError, ImportError), err:
+                log.error('Error loading plugin %r: %s' % (info.name, err))
+                return
+            except Exception:
+                log.exception('Error activating plugin %r.' % info.name)
+                return
+
+        slot = getattr(info.plugin, name, None)
+        if info.is_active and hasattr(slot, '_slots'):
+            slot(*args)
+
+    @staticmethod
+    def _set_route(table, name, entries, plugin):
+        """ Store the entries for the name, without the given plugin. """
+        entries = tuple(entry for entry in entries if entry[0] is not plugin)
+        if entries:
+            table[name] = entries
+        else:
+            table.pop(name, None)
+
+    ##### Signals and Slots ###################################################
+
     def add_signal(self, name, signal):
         """
         Register a new signal with the plugin manager. All active plugins with
@@ -438,12 +633,9 @@ class PluginManager(object):
         # Store the signal in the list.
         self._signals[name].append(signal)
 
-        # Now, iterate through our plugins and connect the signal to every
-        # plugin that's currently active.
-        for info in addons.find('plugin', lambda info: info.is_active):
-            slot = getattr(info.plugin, name, None)
-            if not hasattr(slot, '_slots'):
-                continue
+        # Now, connect the signal to the matching slot of every plugin that's
+        # currently active.
+        for plugin, slot in self._routes.get(name, ()):
             signal.connect(slot)
 
         return remover
@@ -454,15 +646,12 @@ class PluginManager(object):
         matching the given name. Any provided arguments will be sent along
         to those slots.
         """
-        for info in addons.find('plugin', lambda info: info.is_active):
-            slot = getattr(info.plugin, name, None)
-            if not hasattr(slot, '_slots'):
-                continue
+        for plugin, slot in self._routes.get(name, ()):
             try:
                 slot(*args)
             except Exception:
                 log.exception('Error running signal through plugin %r.' %
-                              info.data['name'])
+                              plugin.name)
 
     def remove_signal(self, name, signal=None):
         """
@@ -479,14 +668,11 @@ class PluginManager(object):
         if isinstance(signal, (list, tuple)):
             signals = signal
         else:
-            signals = [signal] if signal else self._signals[name].itervalues()
+            signals = [signal] if signal else list(self._signals[name])
 
         for signal in signals:
             self._signals[name].remove(signal)
-            for info in addons.find('plugin', lambda info: info.is_active):
-                slot = getattr(info.plugin, name, None)
-                if not hasattr(slot, '_slots'):
-                    continue
+            for plugin, slot in self._routes.get(name, ()):
                 signal.disconnect(slot)
 
     def add_slot(self, name, slot):
@@ -508,12 +694,9 @@ class PluginManager(object):
             return remover
         self._slots[name].append(slot)
 
-        # Now, iterate through our plugins and connect the slot to every
-        # plugin that's currently active.
-        for info in addons.find('plugin', lambda info: info.is_active):
-            signal = getattr(info.plugin, name, None)
-            if not isinstance(signal, Signal):
-                continue
+        # Now, connect the slot to the matching signal of every plugin that's
+        # currently active.
+        for plugin, signal in self._emitters.get(name, ()):
             signal.connect(slot)
 
         return remover
@@ -535,14 +718,11 @@ class PluginManager(object):
         if isinstance(slot, (tuple,list)):
             slots = slot
         else:
-            slots = [slot] if slot else self._slots[name].itervalues()
+            slots = [slot] if slot else list(self._slots[name])
 
         for slot in slots:
             self._slots[name].remove(slot)
-            for info in addons.find('plugin', lambda info: info.is_active):
-                signal = getattr(info.plugin, name, None)
-                if not isinstance(signal, Signal):
-                    continue
+            for plugin, signal in self._emitters.get(name, ()):
                 signal.disconnect(slot)
 
 manager = PluginManager()
@@ -554,6 +734,174 @@ remove_slot = manager.remove_slot
 
 run_signal = manager.run_signal
 
+###############################################################################
+# Parallel Loading
+###############################################################################
+
+class ImportTask(QRunnable):
+    """
+    A :class:`PySide.QtCore.QRunnable` that imports the module of a plugin on
+    a worker thread. See :class:`PluginLoader`.
+    """
+
+    def __init__(self, info, results):
+        QRunnable.__init__(self)
+        self.info = info
+        self.results = results
+
+    def run(self):
+        module = error = None
+        start = clock()
+        try:
+            module = self.info._load_module()
+        except ImportError, err:
+            error = err
+        except Exception, err:
+            log.exception('Error importing plugin %r.' %
+                          self.info.data['name'])
+            error = err
+        self.results.put((self.info, module, error, clock() - start))
+
+class PluginLoader(object):
+    """
+    Loads many plugins at once, along with the plugins they require. The
+    modules of plugins are imported on worker threads of the global
+    :class:`PySide.QtCore.QThreadPool`, each as soon as the modules of the
+    plugins it requires have been imported. Every plugin is then created on
+    the calling thread, which should be the GUI thread, as soon as its module
+    is ready and the plugins it requires have been created.
+
+    The code at the top level of a plugin's module may be run on a worker
+    thread, so it shouldn't create widgets or touch the plugin system.
+
+    If ``threaded`` is False, or if the calling thread holds Python's import
+    lock, modules are imported one at a time on the calling thread instead.
+    """
+
+    def __init__(self, plugins, threaded=True):
+        self.plugins = list(plugins)
+        self.threaded = threaded
+
+        # The time spent importing and creating each plugin, by name.
+        self.timings = {}
+
+        self._deps = {}
+        self._imported = {}
+        self._failed = set()
+        self._results = Queue.Queue()
+
+    def run(self):
+        """
+        Load the plugins, and return a list of the ones that were loaded.
+        Errors are logged rather than raised.
+        """
+        threaded = self.threaded and not imp.lock_held()
+        pool = QThreadPool.globalInstance()
+
+        waiting = self._collect()
+        started = set()
+        loaded = []
+        running = 0
+
+        while waiting:
+            progress = False
+            for info in list(waiting):
+                deps = self._deps[info.name]
+                failed = [dep for dep in deps if dep.name in self._failed]
+                if failed:
+                    self._fail(info, addons.DependencyError(
+                        'Plugin %r requires %r, which failed to load.' % (
+                        info.data['name'], failed[0].data['name'])))
+                    waiting.remove(info)
+                    progress = True
+
+                elif info.name not in started:
+                    if all(dep.is_loaded or dep.name in self._imported
+                           for dep in deps):
+                        started.add(info.name)
+                        running += 1
+                        task = ImportTask(info, self._results)
+                        if threaded:
+                            pool.start(task)
+                        else:
+                            task.run()
+                        progress = True
+
+                elif info.name in self._imported and \
+                        all(dep.is_loaded for dep in deps):
+                    waiting.remove(info)
+                    progress = True
+                    if self._finish(info):
+                        loaded.append(info)
+
+            if progress or not waiting:
+                continue
+
+            if not running:
+                # Nothing can happen, so this must be a dependency loop.
+                for info in waiting:
+                    self._fail(info, addons.DependencyError(
+                        'Plugin %r is part of a dependency loop.' %
+                        info.data['name']))
+                break
+
+            info, module, error, seconds = self._results.get()
+            running -= 1
+            self.timings[info.name] = (seconds, None)
+            if error is not None:
+                self._fail(info, error)
+                waiting.remove(info)
+            else:
+                self._imported[info.name] = module
+
+        # Wait for any imports that are still running.
+        while running:
+            self._results.get()
+            running -= 1
+
+        return loaded
+
+    def _collect(self):
+        """
+        Check each plugin, and the plugins it requires, and return a list of
+        the ones that need loading.
+        """
+        out = []
+        pending = list(self.plugins)
+        while pending:
+            info = pending.pop(0)
+            if info.is_loaded or info.name in self._deps or \
+                    info.name in self._failed:
+                continue
+            try:
+                deps = info._check_load()
+            except (addons.DependencyError, KeyError), err:
+                self._fail(info, err)
+                continue
+            self._deps[info.name] = deps
+            pending.extend(deps)
+            out.append(info)
+        return out
+
+    def _finish(self, info):
+        """ Create the plugin on this thread. Return True if it worked. """
+        start = clock()
+        try:
+            info._finish_load(self._imported.pop(info.name))
+        except (addons.DependencyError, ImportError), err:
+            self._fail(info, err)
+            return False
+
+        seconds = clock() - start
+        self.timings[info.name] = (self.timings[info.name][0], seconds)
+        log.debug('Loaded plugin %r: import %.3fs, instantiate %.3fs.' % (
+                  info.data['name'], self.timings[info.name][0], seconds))
+        return True
+
+    def _fail(self, info, error):
+        self._failed.add(info.name)
+        log.error('Error loading plugin %r: %s' % (info.data['name'], error))
+
 ###############################################################################
 # Initialization
 ###############################################################################
@@ -570,8 +918,12 @@ def initialize(args=None, **kwargs):
     load            ``True``        If this is True, plugins will be loaded automatically after discovery.
     activate        ``True``        If this is True, plugins will be activated automatically after loading.
     paths           ``[]``          A list of paths to search for plugins.
+    parallel        ``True``        If this is True, the modules of plugins are imported on worker threads, as described in :class:`PluginLoader`.
     ==============  ==============  ============
 
+    Plugins that declare their slots in their information file are left
+    dormant rather than loaded, as described in :class:`PluginManager`.
+
     In addition, you can provide a list of command line arguments to have
     siding load them automatically. Example::
 
@@ -625,17 +977,25 @@ def initialize(args=None, **kwargs):
         return
 
     if kwargs.get('load', True):
-        for info in addons.find('plugin', lambda info: not info.is_loaded):
-            try:
-                info.load()
-            except (addons.DependencyError, ImportError), err:
-                log.error('Error loading plugin %r: %s' %
-                          (info.data['name'], err))
+        # Plugins that declare their slots wait until they're needed, unless
+        # a plugin that's loaded now depends on them. The rest are loaded in
+        # dependency order, with their modules imported in parallel.
+        infos = []
+        for info in addons.load_order('plugin'):
+            if info.is_loaded:
+                continue
+            if info.slots:
+                if not info.is_blacklisted:
+                    manager._add_dormant(info)
+                continue
+            infos.append(info)
+
+        PluginLoader(infos, kwargs.get('parallel', True)).run()
 
     # And activation...
     if kwargs.get('activate', True):
-        for info in addons.find('plugin', lambda info: info.is_loaded):
-            if info.is_active:
+        for info in addons.load_order('plugin'):
+            if not info.is_loaded or info.is_active:
                 continue
             try:
                 info.plugin.activate()
@@ -130,6 +130,19 @@ def remove(key):
     assert_profile()
     settings.remove(key)
 
+
+def group(name):
+    """
+    Return a dictionary of the keys directly within the given group of the
+    loaded profile, and their values.
+    """
+    assert_profile()
+    settings.beginGroup(name)
+    try:
+        return dict((key, settings.value(key)) for key in settings.childKeys())
+    finally:
+        settings.endGroup()
+
 ###############################################################################
 # Initialization
 ###############################################################################